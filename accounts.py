@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tiktok import getAuthTokens
+
+# Set in each worker process by initWorker
+downloadSemaphore = None
+
+class ProcessSlots:
+  # Async view of a semaphore shared by every account process.
+  # Polls instead of blocking a thread, so a cancelled download never holds a slot.
+  def __init__(self, semaphore, pollInterval=0.05):
+    self.semaphore = semaphore
+    self.pollInterval = pollInterval
+
+  async def __aenter__(self):
+    while not self.semaphore.acquire(block=False):
+      await asyncio.sleep(self.pollInterval)
+    return self
+
+  async def __aexit__(self, *exc):
+    self.semaphore.release()
+
+def initWorker(semaphore):
+  global downloadSemaphore
+  downloadSemaphore = semaphore
+
+def loadAccounts(paths):
+  # Either config files directly, or a JSON list of them (relative to the list file)
+  configPaths = []
+  for path in paths:
+    if path.endswith('.json') and isAccountList(path):
+      with open(path, 'r') as f:
+        baseDir = os.path.dirname(os.path.abspath(path))
+        configPaths.extend(os.path.join(baseDir, entry) for entry in json.load(f))
+    else:
+      configPaths.append(path)
+  return [os.path.abspath(path) for path in configPaths]
+
+def isAccountList(path):
+  with open(path, 'r') as f:
+    try:
+      return isinstance(json.load(f), list)
+    except json.JSONDecodeError:
+      return False
+
+def runAccount(configPath):
+  # Each account works from its config's directory, so data files, journals and
+  # the output dir never collide with another account's
+  from tiktok_collections import loadConfig
+  from main import run
+  from metrics import metrics
+
+  # Pool workers are reused, so the previous account's counters must not leak into this report
+  metrics.reset()
+  os.chdir(os.path.dirname(configPath))
+  started = time.time()
+  config = loadConfig(configPath)
+  user = config.get('app_context', {}).get('user', {}).get('uniqueId', configPath)
+  msToken, sessionId = getAuthTokens(config.get('cookies', []))
+  if not (msToken and sessionId):
+    return { "account": user, "config": configPath, "ok": False, "seconds": 0,
+             "error": f"No session cookies - run python tiktok.py {configPath} to log in" }
+
+  slots = ProcessSlots(downloadSemaphore) if downloadSemaphore is not None else None
+  try:
+    asyncio.run(run(config, slots=slots))
+    return { "account": user, "config": configPath, "ok": True, "seconds": round(time.time() - started, 1) }
+  except Exception as e:
+    return { "account": user, "config": configPath, "ok": False, "seconds": round(time.time() - started, 1), "error": str(e) }
+
+def runAccounts(configPaths, processes=2, maxDownloads=8):
+  # Spawned workers start clean instead of inheriting this process' state
+  context = multiprocessing.get_context('spawn')
+  semaphore = context.BoundedSemaphore(maxDownloads) if maxDownloads else None
+  results = []
+  with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                           initializer=initWorker, initargs=(semaphore,)) as pool:
+    futures = { pool.submit(runAccount, path): path for path in configPaths }
+    for future in as_completed(futures):
+      try:
+        result = future.result()
+      except Exception as e:
+        # The worker process itself died
+        result = { "account": futures[future], "config": futures[future], "ok": False, "seconds": 0, "error": str(e) }
+      status = "done" if result['ok'] else f"failed - {result['error']}"
+      print(f"\n[{result['account']}] {status} ({result['seconds']}s)")
+      results.append(result)
+  return results
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Back up several TikTok accounts in parallel")
+  parser.add_argument("configs", nargs="+", help="account config files, or a JSON list of config paths")
+  parser.add_argument("--processes", type=int, default=2, help="accounts backed up at once")
+  parser.add_argument("--max-downloads", type=int, default=8, help="downloads in flight across all accounts (0 for no cap)")
+  args = parser.parse_args(argv)
+
+  configPaths = loadAccounts(args.configs)
+  results = runAccounts(configPaths, min(args.processes, len(configPaths)), args.max_downloads)
+  failed = [result for result in results if not result['ok']]
+  print(f"\n{len(results) - len(failed)}/{len(results)} accounts backed up")
+  return 1 if failed else 0
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stub_server import StubServer, StubState
+from download import downloadCollectionVideos
+from http_client import createClient
+from metrics import metrics
+from ratelimit import createRateLimiter
+from tiktok_collections import getCollectionData, getCollectionItems, getFavorites
+
+def percentile(values, fraction):
+  if not values: return None
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def peakRssMb():
+  # ru_maxrss is KB on Linux, bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class StageRecorder:
+  def __init__(self, stub):
+    self.stub = stub
+    self.stage = None
+    self.latencies = {}
+    self.stages = []
+
+  def attach(self, client):
+    async def onRequest(request):
+      request.extensions["benchStart"] = time.perf_counter()
+
+    async def onResponse(response):
+      started = response.request.extensions.get("benchStart")
+      if started is not None and self.stage:
+        self.latencies.setdefault(self.stage, []).append(time.perf_counter() - started)
+
+    client.event_hooks["request"].append(onRequest)
+    client.event_hooks["response"].append(onResponse)
+
+  async def run(self, name, operation, countItems):
+    self.stage = name
+    bytesBefore = self.stub.state.bytesSent
+    started = time.perf_counter()
+    result = await operation()
+    elapsed = time.perf_counter() - started
+    items = countItems(result)
+    megabytes = (self.stub.state.bytesSent - bytesBefore) / (1024 * 1024)
+    latencies = self.latencies.get(name, [])
+    self.stages.append({
+      "stage": name,
+      "seconds": round(elapsed, 3),
+      "items": items,
+      "itemsPerSec": round(items / elapsed, 2) if elapsed else None,
+      "megabytes": round(megabytes, 2),
+      "mbPerSec": round(megabytes / elapsed, 2) if elapsed else None,
+      "requests": len(latencies),
+      "p50Ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+      "p99Ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+      "peakRssMb": round(peakRssMb(), 1)
+    })
+    self.stage = None
+    return result
+
+def buildConfig(baseUrl, args):
+  return {
+    "cookies": [{ "name": "sessionid", "value": "bench" }, { "name": "msToken", "value": "bench" }],
+    "app_context": {
+      "user": { "uniqueId": "bench", "secUid": "bench-sec", "nickName": "bench", "uid": "1" },
+      "userAgent": "tiktok-collections-bench"
+    },
+    "options": {
+      "baseUrl": baseUrl,
+      "concurrency": args.concurrency,
+      "perHostLimit": args.per_host,
+      "requestsPerSecond": args.rps,
+      "maxRequestsPerSecond": max(args.rps, args.rps * 4),
+      "burst": args.burst,
+      "fullSync": True
+    }
+  }
+
+async def runStages(stub, config, recorder):
+  async with createClient(config) as client:
+    recorder.attach(client)
+    limiter = createRateLimiter(config)
+
+    collections = await recorder.run("getCollectionData",
+      lambda: getCollectionData(client, config, limiter), len)
+    collectionData = { "collections": collections }
+    await recorder.run("getCollectionItems",
+      lambda: getCollectionItems(client, config, collectionData, limiter=limiter),
+      lambda data: sum(len(c.get("itemList", [])) for c in data["collections"]))
+    await recorder.run("getFavorites",
+      lambda: getFavorites(client, config, limiter=limiter), len)
+    total = sum(len(c.get("itemList", [])) for c in collectionData["collections"])
+    await recorder.run("downloadCollectionVideos",
+      lambda: downloadCollectionVideos(client, collectionData, config, limiter), lambda _: total)
+
+def printReport(report):
+  print("\nstage                      seconds    items  items/s      MB    MB/s  p50 ms  p99 ms  peak RSS MB")
+  for stage in report["stages"]:
+    print(f"{stage['stage']:<25} {stage['seconds']:>8} {stage['items']:>8} {stage['itemsPerSec'] or '-':>8} "
+          f"{stage['megabytes']:>7} {stage['mbPerSec'] or '-':>7} {stage['p50Ms'] or '-':>7} {stage['p99Ms'] or '-':>7} "
+          f"{stage['peakRssMb']:>12}")
+  print(f"\nstub requests: {report['stubRequests']}  peak RSS: {report['peakRssMb']} MB")
+  print(f"pipeline: {metrics.summary()}")
+
+def parseArgs(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark listing & downloads against a local TikTok stub")
+  parser.add_argument("--collections", type=int, default=5)
+  parser.add_argument("--items", type=int, default=60, help="items per collection")
+  parser.add_argument("--favorites", type=int, default=100)
+  parser.add_argument("--slideshow-ratio", type=float, default=0.1)
+  parser.add_argument("--video-kb", type=int, default=512)
+  parser.add_argument("--image-kb", type=int, default=64)
+  parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every stub response")
+  parser.add_argument("--jitter", type=float, default=0.01)
+  parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of responses that are 500s")
+  parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of responses that are 429s")
+  parser.add_argument("--retry-after", type=int, default=1)
+  parser.add_argument("--record-dir", help="directory of recorded API responses to replay")
+  parser.add_argument("--concurrency", type=int, default=8)
+  parser.add_argument("--per-host", type=int, default=8)
+  parser.add_argument("--rps", type=float, default=50)
+  parser.add_argument("--burst", type=int, default=20)
+  parser.add_argument("--json", help="write the report to this file")
+  parser.add_argument("--keep", action="store_true", help="keep the temporary output directory")
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parseArgs(argv)
+  state = StubState(
+    collections=args.collections, itemsPerCollection=args.items, favorites=args.favorites,
+    slideshowRatio=args.slideshow_ratio, videoSize=args.video_kb * 1024, imageSize=args.image_kb * 1024,
+    latency=args.latency, jitter=args.jitter, errorRate=args.error_rate, throttleRate=args.throttle_rate,
+    retryAfter=args.retry_after, recordDir=args.record_dir
+  )
+  stub = StubServer(state).start()
+  recorder = StageRecorder(stub)
+  config = buildConfig(stub.baseUrl, args)
+
+  # Every output file lands in a scratch directory
+  workDir = tempfile.mkdtemp(prefix="tiktok-bench-")
+  previousDir = os.getcwd()
+  os.chdir(workDir)
+  try:
+    asyncio.run(runStages(stub, config, recorder))
+  finally:
+    os.chdir(previousDir)
+    stub.stop()
+    if not args.keep: shutil.rmtree(workDir, ignore_errors=True)
+
+  report = {
+    "stages": recorder.stages,
+    "stubRequests": state.requests,
+    "peakRssMb": round(peakRssMb(), 1),
+    "metrics": metrics.report(),
+    "args": vars(args)
+  }
+  printReport(report)
+  if args.keep: print(f"Output kept in {workDir}")
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(report, f, indent=2)
+  return report
+
+if __name__ == "__main__":
+  main()
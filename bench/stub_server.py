@@ -0,0 +1,229 @@
+import json
+import os
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+def box(kind, payload):
+  return struct.pack(">I", len(payload) + 8) + kind + payload
+
+def syntheticMp4(size, duration, seed):
+  # ftyp + moov/mvhd carrying the duration + mdat filler, enough for container checks
+  mvhd = struct.pack(">BxxxIIII", 0, 0, 0, 1000, duration * 1000) + bytes(80)
+  header = box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomiso2avc1mp41") + box(b"moov", box(b"mvhd", mvhd))
+  filler = max(0, size - len(header) - 8)
+  return header + box(b"mdat", (seed.encode() * (filler // max(1, len(seed)) + 1))[:filler])
+
+def syntheticJpeg(size, seed):
+  body = (seed.encode() * (size // max(1, len(seed)) + 1))[:max(0, size - 4)]
+  return b"\xff\xd8" + body + b"\xff\xd9"
+
+# (gear, codec, bitrate, short side, share of videoSize) served as bitrateInfo variants
+VARIANTS = [
+  ("normal_1080_0", "h264", 2400000, 1080, 1.0),
+  ("normal_720_0", "h264", 1200000, 720, 0.5),
+  ("normal_720_1", "h265_hvc1", 800000, 720, 0.33),
+  ("normal_540_0", "h264", 600000, 540, 0.25)
+]
+
+def paginate(items, cursor, pageSize):
+  page = items[cursor:cursor + pageSize]
+  nextCursor = cursor + len(page)
+  return page, nextCursor, nextCursor < len(items)
+
+class StubState:
+  def __init__(self, collections=5, itemsPerCollection=60, favorites=100, sharedRatio=0.1,
+               slideshowRatio=0.1, imagesPerSlideshow=4, videoSize=512 * 1024, imageSize=64 * 1024,
+               pageSize=30, latency=0.02, jitter=0.01, errorRate=0.0, throttleRate=0.0,
+               retryAfter=1, recordDir=None, seed=1):
+    self.random = random.Random(seed)
+    self.pageSize = pageSize
+    self.latency = latency
+    self.jitter = jitter
+    self.errorRate = errorRate
+    self.throttleRate = throttleRate
+    self.retryAfter = retryAfter
+    self.videoSize = videoSize
+    self.imageSize = imageSize
+    self.imagesPerSlideshow = imagesPerSlideshow
+    self.lock = threading.Lock()
+    self.bytesSent = 0
+    self.requests = 0
+    self.slideshows = set()
+
+    if recordDir:
+      self.loadRecorded(recordDir)
+    else:
+      self.generate(collections, itemsPerCollection, favorites, sharedRatio, slideshowRatio)
+
+  def makeItem(self, videoId):
+    authorId = f"author{self.random.randint(1, 50)}"
+    musicId = f"music{self.random.randint(1, 20)}"
+    return {
+      "id": videoId,
+      "author": { "id": authorId, "nickname": authorId, "secUid": f"sec-{authorId}", "signature": "",
+                  "uniqueId": authorId, "verified": False },
+      "contents": [],
+      "createTime": 1700000000 + int(videoId[-6:]),
+      "desc": f"bench video {videoId} #stub",
+      "music": { "authorName": "stub", "duration": 30, "id": musicId, "original": False,
+                 "playUrl": f"/media/{musicId}.mp3", "title": musicId },
+      "stats": { "collectCount": 1, "commentCount": 2, "diggCount": 3, "playCount": 4, "shareCount": 5 },
+      "video": { "duration": 15, "format": "mp4", "width": 576, "height": 1024, "id": videoId, "ratio": "540p" }
+    }
+
+  def generate(self, collections, itemsPerCollection, favorites, sharedRatio, slideshowRatio):
+    nextId = iter(range(7000000000000000000, 8000000000000000000))
+    self.collectionList = []
+    self.itemLists = {}
+    allItems = []
+    for index in range(collections):
+      collectionId = f"7{index:018d}"
+      items = [self.makeItem(str(next(nextId))) for _ in range(itemsPerCollection)]
+      # Some items also sit in another collection, to exercise dedup
+      shared = [item for item in allItems if self.random.random() < sharedRatio][:itemsPerCollection // 4]
+      self.itemLists[collectionId] = items + shared
+      allItems.extend(items)
+      self.collectionList.append({ "collectionId": collectionId, "name": f"Bench {index}",
+                                   "total": len(self.itemLists[collectionId]), "status": 3 })
+    extras = [self.makeItem(str(next(nextId))) for _ in range(max(0, favorites - len(allItems) // 2))]
+    self.favorites = extras + allItems[:favorites - len(extras)]
+    self.slideshows = { item["id"] for item in allItems + extras if self.random.random() < slideshowRatio }
+    self.itemsById = { item["id"]: item for item in allItems + extras }
+
+  def loadRecorded(self, recordDir):
+    # Recorded API responses, re-paginated by the stub:
+    # collection_list.json, items_<collectionId>.json, favorites.json
+    def load(name, key):
+      path = os.path.join(recordDir, name)
+      if not os.path.exists(path): return []
+      with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get(key, [])
+    self.collectionList = load("collection_list.json", "collectionList")
+    self.itemLists = { c["collectionId"]: load(f"items_{c['collectionId']}.json", "itemList") for c in self.collectionList }
+    self.favorites = load("favorites.json", "itemList")
+    self.itemsById = { item["id"]: item for items in [*self.itemLists.values(), self.favorites] for item in items }
+    self.slideshows = { videoId for videoId, item in self.itemsById.items() if item.get("imagePost") }
+
+  def countBytes(self, size):
+    with self.lock:
+      self.bytesSent += size
+      self.requests += 1
+
+class StubHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format, *args):
+    pass
+
+  @property
+  def state(self):
+    return self.server.state
+
+  def send(self, status, body=b"", contentType="application/json", headers=None):
+    self.send_response(status)
+    self.send_header("Content-Type", contentType)
+    self.send_header("Content-Length", str(len(body)))
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+    self.state.countBytes(len(body))
+
+  def sendJson(self, data):
+    self.send(200, json.dumps(data).encode())
+
+  def do_GET(self):
+    state = self.state
+    time.sleep(max(0, state.latency + state.random.uniform(-state.jitter, state.jitter)))
+    roll = state.random.random()
+    if roll < state.throttleRate:
+      return self.send(429, b"{}", headers={ "Retry-After": str(state.retryAfter) })
+    if roll < state.throttleRate + state.errorRate:
+      return self.send(500, b"{}")
+
+    url = urlsplit(self.path)
+    query = { key: values[0] for key, values in parse_qs(url.query).items() }
+    cursor = int(query.get("cursor", 0))
+
+    if url.path == "/api/user/collection_list/":
+      page, nextCursor, hasMore = paginate(state.collectionList, cursor, state.pageSize)
+      return self.sendJson({ "collectionList": page, "cursor": nextCursor, "hasMore": hasMore })
+    if url.path == "/api/collection/item_list/":
+      items = state.itemLists.get(query.get("collectionId"), [])
+      page, nextCursor, hasMore = paginate(items, cursor, state.pageSize)
+      return self.sendJson({ "itemList": page, "cursor": nextCursor, "hasMore": hasMore })
+    if url.path == "/api/user/collect/item_list/":
+      page, nextCursor, hasMore = paginate(state.favorites, cursor, state.pageSize)
+      return self.sendJson({ "itemList": page, "cursor": nextCursor, "hasMore": hasMore })
+    if "/video/" in url.path:
+      return self.videoPage(url.path.rsplit("/", 1)[-1])
+    if url.path.startswith("/media/"):
+      return self.media(url.path[len("/media/"):])
+    self.send(404, b"{}")
+
+  def videoPage(self, videoId):
+    state = self.state
+    item = dict(state.itemsById.get(videoId) or state.makeItem(videoId))
+    base = f"http://{self.headers.get('Host')}"
+    item["video"] = { **item["video"], "downloadAddr": f"{base}/media/{videoId}.mp4", "playAddr": f"{base}/media/{videoId}.mp4",
+                      "bitrateInfo": [
+                        { "GearName": gear, "CodecType": codec, "Bitrate": bitrate,
+                          "PlayAddr": { "Width": side, "Height": side * 16 // 9, "DataSize": int(state.videoSize * share),
+                                        "UrlList": [f"{base}/media/{videoId}~{gear}.mp4"] } }
+                        for gear, codec, bitrate, side, share in VARIANTS
+                      ] }
+    if videoId in state.slideshows:
+      item["imagePost"] = { "images": [
+        { "imageURL": { "urlList": [f"{base}/media/{videoId}-{i}.jpg", f"{base}/media/{videoId}-{i}.jpg?mirror=1"] } }
+        for i in range(state.imagesPerSlideshow)
+      ] }
+    blob = json.dumps({ "__DEFAULT_SCOPE__": { "webapp.video-detail": { "statusCode": 0, "itemInfo": { "itemStruct": item } } } })
+    html = f'<html><head></head><body><script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">{blob}</script></body></html>'
+    self.send(200, html.encode(), "text/html", { "Set-Cookie": "tt_chain_token=stub; Path=/" })
+
+  def media(self, name):
+    state = self.state
+    if name.endswith(".mp4"):
+      gear = name[:-len(".mp4")].partition("~")[2]
+      share = next((share for variant, _codec, _bitrate, _side, share in VARIANTS if variant == gear), 1.0)
+      body = syntheticMp4(int(state.videoSize * share), 15, name)
+      contentType = "video/mp4"
+    elif name.endswith(".jpg"):
+      body = syntheticJpeg(state.imageSize, name)
+      contentType = "image/jpeg"
+    else:
+      body = bytes(state.imageSize)
+      contentType = "audio/mpeg"
+
+    rangeHeader = self.headers.get("Range")
+    if not rangeHeader:
+      return self.send(200, body, contentType)
+    start = int(rangeHeader.split("=", 1)[1].split("-", 1)[0] or 0)
+    if start >= len(body):
+      return self.send(416, b"", contentType, { "Content-Range": f"bytes */{len(body)}" })
+    self.send(206, body[start:], contentType, { "Content-Range": f"bytes {start}-{len(body) - 1}/{len(body)}" })
+
+class StubServer:
+  def __init__(self, state, host="127.0.0.1", port=0):
+    self.state = state
+    self.server = ThreadingHTTPServer((host, port), StubHandler)
+    self.server.daemon_threads = True
+    self.server.state = state
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+  @property
+  def baseUrl(self):
+    host, port = self.server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def start(self):
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
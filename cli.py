@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from tiktok import CONFIG_FILE, getOutputDir, loadConfig
+
+# Heavy modules (httpx, TikTokApi, playwright, tqdm) are imported inside the commands that need them
+
+def loadConfigOrExit(path):
+  try:
+    return loadConfig(path)
+  except FileNotFoundError:
+    print(f"No config at {path} - run: python cli.py login --config {path}")
+    sys.exit(1)
+
+def commandLogin(args):
+  from tiktok import getTiktokData
+  getTiktokData(args.config)
+
+async def listAll(config):
+  from tiktok_collections import getCollectionData, getCollectionItems, getFavorites
+  from http_client import createClient
+  from ratelimit import createRateLimiter
+
+  async with createClient(config) as client:
+    limiter = createRateLimiter(config)
+    collections = await getCollectionData(client, config, limiter)
+    await getCollectionItems(client, config, { "collections": collections }, limiter=limiter)
+    await getFavorites(client, config, limiter=limiter)
+
+def commandList(args):
+  config = loadConfigOrExit(args.config)
+  asyncio.run(listAll(config))
+
+def commandSync(args):
+  from main import run
+  config = loadConfigOrExit(args.config)
+  asyncio.run(run(config, dryRun=args.dry_run))
+
+async def downloadSaved(config, collectionData, strategies=None):
+  from download import downloadCollectionVideos
+  from http_client import createClient
+  from metrics import exportMetrics
+
+  try:
+    async with createClient(config) as client:
+      return await downloadCollectionVideos(client, collectionData, config, strategies=strategies)
+  finally:
+    exportMetrics(config, getOutputDir(config))
+
+def commandDownload(args):
+  from tiktok_collections import loadSavedListing
+  config = loadConfigOrExit(args.config)
+  collectionData = loadSavedListing(config)
+  if args.dry_run:
+    from main import printDryRun
+    printDryRun(config, collectionData)
+    return
+  asyncio.run(downloadSaved(config, collectionData))
+
+def commandRetryFailures(args):
+  from models import CollectionItem
+  from failures import FailureLog, strategyFor
+  config = loadConfigOrExit(args.config)
+  failureLog = FailureLog(getOutputDir(config))
+  failures = failureLog.select(args.classes, args.include_classified)
+  skipped = len(failureLog.entries) - len(failures)
+  if not failures:
+    print("No failed downloads to retry" + (f" ({skipped} skipped by class)" if skipped else ""))
+    return
+
+  # Only the failed items are queued, each with the strategy for its error class
+  collections = {}
+  strategies = {}
+  byClass = {}
+  for videoId, failure in failures.items():
+    item = CollectionItem.fromDict(failure['metadata'])
+    for collectionName in failure.get('collections', [failure['collection']]):
+      collections.setdefault(collectionName, []).append(item)
+    strategies[videoId] = strategyFor(failure)
+    errorClass = failure.get('class', 'other')
+    byClass[errorClass] = byClass.get(errorClass, 0) + 1
+  collectionData = { "collections": [{ "name": name, "itemList": items } for name, items in collections.items()] }
+  print(f"Retrying {len(failures)} failed downloads ({', '.join(f'{count} {name}' for name, count in sorted(byClass.items()))})")
+  if skipped: print(f"Skipping {skipped} by class - see --classes and --include-classified")
+
+  asyncio.run(downloadSaved(config, collectionData, strategies))
+
+def commandVerify(args):
+  from manifest import openManifest
+  from store import ContentStore
+  from verify import verifyLibrary
+  config = loadConfigOrExit(args.config)
+  outputDir = getOutputDir(config)
+  if not os.path.isdir(outputDir):
+    print(f"Nothing to verify - {outputDir} does not exist")
+    return
+
+  manifest = openManifest(outputDir)
+  indexed = None
+  if os.path.exists(os.path.join(outputDir, "metadata.db")):
+    from metadata_index import MetadataIndex
+    index = MetadataIndex(outputDir)
+    try:
+      indexed = index.byPath()
+    finally:
+      index.close()
+  try:
+    report, failures = verifyLibrary(outputDir, manifest, ContentStore(outputDir), args.checksum, args.workers, not args.report_only, indexed)
+  finally:
+    manifest.close()
+
+  logsDir = os.path.join(outputDir, "logs")
+  os.makedirs(logsDir, exist_ok=True)
+  with open(os.path.join(logsDir, "verify_report.json"), "w", encoding="utf-8") as f:
+    json.dump(report, f, indent=2, ensure_ascii=False)
+  if failures:
+    # Queued next to earlier download failures, for retry-failures or the next sync
+    from failures import FailureLog
+    failureLog = FailureLog(outputDir)
+    failureLog.merge(failures)
+    failureLog.save()
+
+  print(f"\nChecked {report['items']} items in {report['seconds']}s - {report['failed']} failed")
+  for failure in report['failures'][:20]:
+    print(f"  {failure['path']}: {'; '.join(failure['problems'])}")
+  if report['failed'] > 20: print(f"  ... and {report['failed'] - 20} more in logs/verify_report.json")
+  if report['incomplete']: print(f"{report['incomplete']} interrupted downloads will be retried on the next download")
+  if failures: print(f"{len(failures)} items queued for re-download - run: python cli.py retry-failures")
+
+def parseDate(text):
+  from datetime import datetime
+  try:
+    return int(datetime.strptime(text, '%Y-%m-%d').timestamp())
+  except ValueError:
+    raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {text}")
+
+def commandQuery(args):
+  from datetime import datetime
+  from metadata_index import openMetadataIndex
+  outputDir = getOutputDir(loadConfigOrExit(args.config))
+  if not os.path.isdir(outputDir):
+    print(f"Nothing to query - {outputDir} does not exist")
+    return
+
+  # Built from the per-item JSON files the first time, then kept up to date by downloads
+  index = openMetadataIndex(outputDir)
+  try:
+    items = index.query(args.author, args.music, args.collection, args.since, args.until, args.text, args.sort, args.limit)
+  finally:
+    index.close()
+
+  if args.json:
+    print(json.dumps(items, indent=2, ensure_ascii=False))
+    return
+  for item in items:
+    created = datetime.fromtimestamp(item['createTime']).strftime('%Y-%m-%d')
+    print(f"{created}  @{item['author']['uniqueId']:<24} {item['stats']['playCount']:>12,} plays  {item['desc'][:50]}")
+    for path in item['paths']: print(f"    {path}")
+  print(f"{len(items)} items")
+
+def gatherStats(config):
+  from manifest import Manifest
+  outputDir = getOutputDir(config)
+  user = config['app_context']['user']['uniqueId']
+  stats = { "account": user, "outputDir": outputDir }
+
+  def readJson(path):
+    try:
+      with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+
+  listing = readJson(f"collection_data_{user}.json")
+  if listing:
+    collections = listing.get('collections', [])
+    syncedAt = [c['watermark']['syncedAt'] for c in collections if 'watermark' in c]
+    stats["listing"] = {
+      "collections": len(collections),
+      "items": sum(len(c.get('itemList', [])) for c in collections),
+      "lastSyncedAt": max(syncedAt) if syncedAt else None
+    }
+
+  if os.path.exists(os.path.join(outputDir, "manifest.db")):
+    manifest = Manifest(outputDir)
+    try:
+      stats["downloads"] = manifest.counts()
+      stats["collections"] = manifest.collectionCounts()
+    finally:
+      manifest.close()
+
+  failures = readJson(os.path.join(outputDir, "logs", "download_failures.json"))
+  stats["pendingFailures"] = len(failures) if failures else 0
+  report = readJson(os.path.join(outputDir, "logs", "run_report.json"))
+  if report:
+    stats["lastRun"] = { "startedAt": report['startedAt'], "durationSeconds": report['durationSeconds'] }
+  return stats
+
+def printStats(stats):
+  from datetime import datetime
+  formatTime = lambda timestamp: datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M') if timestamp else "never"
+
+  print(f"Account: {stats['account']} ({stats['outputDir']})")
+  listing = stats.get('listing')
+  if listing:
+    print(f"Listed: {listing['items']} items in {listing['collections']} collections, last synced {formatTime(listing['lastSyncedAt'])}")
+  downloads = stats.get('downloads', {})
+  print("Downloads: " + (", ".join(f"{count} {status}" for status, count in sorted(downloads.items())) or "none yet"))
+  for name, counts in sorted(stats.get('collections', {}).items()):
+    print(f"  {name[:40]:<40} {counts.get('complete', 0):>6} saved  {counts['bytes'] / (1024 * 1024):>9.1f} MB")
+  print(f"Failures waiting for retry: {stats['pendingFailures']}")
+  lastRun = stats.get('lastRun')
+  if lastRun:
+    print(f"Last run: {formatTime(lastRun['startedAt'])}, took {lastRun['durationSeconds']:.0f}s")
+
+def commandStats(args):
+  stats = gatherStats(loadConfigOrExit(args.config))
+  if args.json: print(json.dumps(stats, indent=2))
+  else: printStats(stats)
+
+def parseArgs(argv=None):
+  parser = argparse.ArgumentParser(prog="cli.py", description="Back up TikTok collections")
+  parser.add_argument("--config", default=CONFIG_FILE, help=f"account config file (default {CONFIG_FILE})")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  commands.add_parser("login", help="log in with a browser and save session cookies").set_defaults(handler=commandLogin)
+  commands.add_parser("list", help="refresh collection & favorites metadata only").set_defaults(handler=commandList)
+  sync = commands.add_parser("sync", help="list, then download everything new")
+  sync.add_argument("--dry-run", action="store_true", help="list, then only report what would be downloaded")
+  sync.set_defaults(handler=commandSync)
+  download = commands.add_parser("download", help="download from the last saved listing")
+  download.add_argument("--dry-run", action="store_true", help="only report what would be downloaded")
+  download.set_defaults(handler=commandDownload)
+  retry = commands.add_parser("retry-failures", help="retry only the downloads in the failures log")
+  retry.add_argument("--classes", nargs="+", metavar="CLASS",
+                     help="only retry these error classes (classified, cdn_403, expired_token, blocked, throttled, network, corrupt, other)")
+  retry.add_argument("--include-classified", action="store_true", help="also retry items TikTok reported as private or removed")
+  retry.set_defaults(handler=commandRetryFailures)
+  verify = commands.add_parser("verify", help="check every saved file and queue broken ones for re-download")
+  verify.add_argument("--checksum", action="store_true", help="also compare full-file hashes with the manifest")
+  verify.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+  verify.add_argument("--report-only", action="store_true", help="report problems without queueing re-downloads")
+  verify.set_defaults(handler=commandVerify)
+  query = commands.add_parser("query", help="search saved items by author, sound, date or text without opening each file")
+  query.add_argument("--author", help="author username")
+  query.add_argument("--music", metavar="MUSIC_ID", help="items using this sound")
+  query.add_argument("--collection")
+  query.add_argument("--since", type=parseDate, metavar="YYYY-MM-DD", help="posted on or after")
+  query.add_argument("--until", type=parseDate, metavar="YYYY-MM-DD", help="posted before")
+  query.add_argument("--text", help="words in the description")
+  query.add_argument("--sort", choices=["created", "plays", "likes", "comments", "shares", "saves"], default="created")
+  query.add_argument("--limit", type=int, default=20)
+  query.add_argument("--json", action="store_true")
+  query.set_defaults(handler=commandQuery)
+  stats = commands.add_parser("stats", help="summarize the backup without any network access")
+  stats.add_argument("--json", action="store_true")
+  stats.set_defaults(handler=commandStats)
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parseArgs(argv)
+  args.handler(args)
+
+if __name__ == "__main__":
+  main()
@@ -1,30 +1,29 @@
-from TikTokApi import TikTokApi
-from tiktok import getAuthTokens
+from tiktok import getAuthTokens, getOption, getOutputDir
 from tiktok_collections import loadConfig
+from http_client import createClient, cookieHeader
+from store import ContentStore, linkFile, hashFile
+from manifest import openManifest
+from metadata_index import MetadataIndex, openMetadataIndex
+from planner import DownloadPlanner, itemFilenameBase, COMPLETE
+from models import loadCollections, toJson
+from ratelimit import createRateLimiter, backoff
+from metrics import metrics, exportMetrics, errorCause
+from sounds import SoundStage, soundReference
+from quality import qualityPolicy, applyQualityPolicy
+from failures import FailureLog, classifyError, isCaptcha, RETRY_STRATEGIES, OTHER
+from types import SimpleNamespace
+from contextlib import asynccontextmanager, nullcontext
 import os
 import json
-from tqdm import tqdm
-import time
-from datetime import datetime
+import hashlib
+from urllib.parse import urlsplit
 import asyncio
-import httpx
-
-def cleanFilename(text, maxWords=12, maxLength=60):
-  # Max Words
-  text = text.replace(':', '--')
-  words = text.split()[:maxWords]
-  cleaned = ' '.join(words)
+import re
+import time
 
-  # Invalid characters
-  invalidChars = '<>:"/\\|?*'
-  for char in invalidChars:
-    cleaned = cleaned.replace(char, '')
+jsonDecoder = json.JSONDecoder()
 
-  # Max string length
-  if len(cleaned) > maxLength:
-    cleaned = cleaned[:maxLength-3] + '...' 
-  
-  return cleaned
+DEFAULT_STRATEGY = RETRY_STRATEGIES[OTHER]
 
 def getIdFromUrl(url): return url.split('/')[-1]
 
@@ -37,140 +36,363 @@ def getDownloadAddr(info):
       ""
     )
 
-async def withRetries(operation, maxRetries=3):
+async def withRetries(operation, maxRetries=3, limiter=None, stage='operation'):
   for attempt in range(maxRetries):
     try:
-      return await operation()
+      result = await operation()
+      if limiter: limiter.onSuccess()
+      return result
     except Exception as e:
+      if limiter: limiter.report(e)
       if attempt == maxRetries - 1:
         print(f"Max retries reached. Error: {str(e)}")
         print(f"\nError from operation: {operation}")
         raise
-      # Exponential backoff: 2^0=1, 2^1=2, 2^2=4 seconds, etc.
-      await asyncio.sleep(2 ** attempt)
-
-def skipDuplicateVideos(file):
-  if os.path.exists(file):
-    existingSize = os.path.getsize(file)
-    return existingSize > 300 * 1024  # 300KB
-  
-def skipDuplicatePhotos(path, photoCount):
-  if not os.path.exists(path):
-    return False
-  PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
-  return len([f for f in os.listdir(path)
-    if f.lower().endswith(PHOTO_EXTENSIONS)]) >= photoCount
-
-async def fetchVideo(api, url):
-  try:
-    video = api.video(url=url)
-    info = await video.info()
-    if info.get('isContentClassified') == True:
-      print(f"\nisClassified: {url}")
-      info = manualFetch(url)
+      metrics.retry(stage, e)
+      # Jittered exponential backoff, plus any Retry-After pause the limiter is holding
+      await backoff(attempt, limiter)
+
+class BrowserSession:
+  def __init__(self, index):
+    self.index = index
+    self.api = None
+    self.lock = asyncio.Lock()
+    self.inFlight = 0
+    self.requests = 0
+    self.failures = 0
+    self.consecutiveFailures = 0
+    self.captchas = 0
+    self.restarts = 0
+
+  def stats(self):
+    return {
+      "index": self.index,
+      "started": self.api is not None,
+      "inFlight": self.inFlight,
+      "requests": self.requests,
+      "failures": self.failures,
+      "captchas": self.captchas,
+      "restarts": self.restarts
+    }
+
+class BrowserPool:
+  # TikTokApi browser sessions, each started only once the plain HTTP path needs it
+  def __init__(self, config):
+    self.config = config
+    self.maxFailures = getOption(config, 'sessionMaxFailures')
+    self.sessions = [BrowserSession(i) for i in range(getOption(config, 'browserSessions'))]
+
+  async def start(self, session):
+    async with session.lock:
+      if session.api is None:
+        from TikTokApi import TikTokApi
+        print(f"\nStarting browser session {session.index}")
+        msToken, _s = getAuthTokens(self.config['cookies'])
+        api = TikTokApi()
+        try:
+          await api.create_sessions(ms_tokens=[msToken], num_sessions=1, sleep_after=5)
+        except Exception:
+          # A half-started session still owns a Playwright driver and browser
+          try:
+            await api.close_sessions()
+          except Exception as e:
+            print(f"\nError closing browser session {session.index}: {e}")
+          raise
+        session.api = api
+      return session.api
+
+  async def evict(self, session, api, reason):
+    # Drop the browser context so the next request through this slot starts a fresh one
+    if api is None or session.api is not api: return  # Already recreated by another request
+    print(f"\nRecreating browser session {session.index} - {reason}")
+    session.api = None
+    session.consecutiveFailures = 0
+    session.restarts += 1
+    try:
+      await api.close_sessions()
+    except Exception as e:
+      print(f"\nError closing browser session {session.index}: {e}")
+
+  @asynccontextmanager
+  async def session(self):
+    # Least busy session first, preferring ones with fewer recent failures
+    session = min(self.sessions, key=lambda s: (s.inFlight, s.consecutiveFailures))
+    session.inFlight += 1
+    session.requests += 1
+    api = None
+    try:
+      api = await self.start(session)
+      yield api
+      session.consecutiveFailures = 0
+    except Exception as e:
+      session.failures += 1
+      session.consecutiveFailures += 1
+      if isCaptcha(e):
+        session.captchas += 1
+        await self.evict(session, api, "captcha")
+      elif session.consecutiveFailures >= self.maxFailures:
+        await self.evict(session, api, f"{session.consecutiveFailures} failures in a row")
+      raise
+    finally:
+      session.inFlight -= 1
+
+  async def video(self, url):
+    async with self.session() as api:
+      video = api.video(url=url)
+      info = await video.info()
     getDownloadAddr(info)
     return video, info
-  except Exception as e:
-    print(f"\nError fetching video. Retrying {url} - {e}")
-    raise
 
-async def saveVideo(video, videoPath, info, saveLog):
-  try:
-    videoBytes = await withRetries(lambda: video.bytes())
-  except Exception as e:
-    print("\nvideo.bytes() failed - Downloading manually")
-    downloadAddr = info["video"]["downloadAddr"]
-    challengeToken = info.get('tt_chain_token')
-    videoBytes = await manuallySaveVideo(downloadAddr, challengeToken)
-  print(saveLog)
-  with open(videoPath, "wb") as output:
-    output.write(videoBytes)
+  async def downloadRequest(self, url):
+    # The video's downloadAddr and the headers the browser session would send for it
+    async with self.session() as api:
+      video = api.video(url=url)
+      info = await video.info()
+      _index, browserSession = api._get_session()
+      cookies = await api.get_session_cookies(browserSession)
+    getDownloadAddr(info)
+    headers = {
+      "Cookie": "; ".join(f"{name}={value}" for name, value in cookies.items() if value),
+      "Accept-Encoding": 'identity;q=1, *;q=0'
+    }
+    userAgent = (browserSession.headers or {}).get("User-Agent") or (browserSession.headers or {}).get("user-agent")
+    if userAgent: headers["User-Agent"] = userAgent
+    return info, headers
+
+  def stats(self):
+    return [session.stats() for session in self.sessions]
+
+  async def close(self):
+    for session in self.sessions:
+      if session.api is not None:
+        await session.api.close_sessions()
+        session.api = None
+
+async def fetchVideo(browser, client, url, preferBrowser=False, hostLimiter=None):
+  with metrics.timed('fetchVideo'):
+    if preferBrowser:
+      # Plain HTTP was already refused for this item on an earlier run
+      _video, info = await browser.video(url)
+      getDownloadAddr(info)
+      return info
+    try:
+      info = await holdingSlot(None, lambda: manualFetch(client, url), hostLimiter and hostLimiter.get(url))
+    except Exception as e:
+      print(f"\nHTTP fetch failed, using browser session - {url} - {e}")
+      metrics.inc('browser_fallbacks_total', stage='fetchVideo', cause=errorCause(e))
+      try:
+        _video, info = await browser.video(url)
+      except Exception as e:
+        print(f"\nError fetching video. Retrying {url} - {e}")
+        raise
+  getDownloadAddr(info)
+  return info
 
-async def manuallySaveVideo(url, challengeToken=None):
-  config = loadConfig()
-  msToken, sessionId = getAuthTokens(config['cookies'])
-  cookieString = f"sessionid={sessionId}; msToken={msToken}"
-  if challengeToken: cookieString += f"; tt_chain_token={challengeToken}"
+async def saveVideo(client, browser, url, videoPath, info, saveLog, limiter=None, preferBrowser=False, slots=None, hostLimiter=None):
+  print(saveLog)
+  downloadAddr = info["video"]["downloadAddr"]
+  challengeToken = info.get('tt_chain_token')
+  with metrics.timed('saveVideo'):
+    # Returns how the bytes were fetched; the browser only serves its default stream
+    if preferBrowser:
+      await saveWithBrowser(client, browser, url, videoPath, limiter, slots, hostLimiter)
+      return 'browser'
+    try:
+      await manuallySaveVideo(client, downloadAddr, videoPath, challengeToken, limiter, slots, hostLimiter)
+      return 'http'
+    except Exception as e:
+      print(f"\nHTTP download failed, using browser session - {e}")
+      metrics.inc('browser_fallbacks_total', stage='saveVideo', cause=errorCause(e))
+      await saveWithBrowser(client, browser, url, videoPath, limiter, slots, hostLimiter)
+      return 'browser'
+
+async def saveWithBrowser(client, browser, url, videoPath, limiter=None, slots=None, hostLimiter=None):
+  # Same status-checked, resumable stream as the HTTP path, with the browser session's cookies
+  info, headers = await browser.downloadRequest(url)
+  downloadAddr = info["video"]["downloadAddr"]
+  hostSlot = hostLimiter and hostLimiter.get(downloadAddr)
+  await withRetries(lambda: holdingSlot(slots, lambda: streamToFile(client, downloadAddr, videoPath, headers), hostSlot), limiter=limiter, stage='saveVideo')
+
+async def holdingSlot(slots, operation, hostSlot=None):
+  # Host and download slots are held for one request attempt, never across throttle
+  # pauses, backoff sleeps or browser start-up. Host first, so the two never wait on each other
+  async with hostSlot or nullcontext():
+    async with slots or nullcontext():
+      return await operation()
 
+def parseContentRange(header):
+  # "bytes 100-199/200" or "bytes */200"
+  try:
+    return int(header.rsplit('/', 1)[1])
+  except (AttributeError, IndexError, ValueError):
+    return None
+
+async def streamToFile(client, url, path, headers, chunkSize=64 * 1024, stage='saveVideo'):
+  partPath = f"{path}.part"
+  offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+  headers = {**headers, "Range": f"bytes={offset}-"}
+
+  metrics.inc('requests_total', stage=stage)
+  async with client.stream("GET", url, headers=headers) as response:
+    if response.status_code == 416:
+      # Nothing left to fetch when the part file already holds every byte
+      total = parseContentRange(response.headers.get('Content-Range'))
+      if offset and total == offset:
+        os.replace(partPath, path)
+        return
+      if os.path.exists(partPath): os.remove(partPath)
+    response.raise_for_status()
+    # Error and captcha pages sometimes come back as 200
+    contentType = response.headers.get('Content-Type', '')
+    if contentType.startswith(('text/', 'application/json')):
+      raise IOError(f"Expected media, got {contentType} from {url}")
+
+    if response.status_code != 206:
+      offset = 0  # Range ignored, start over
+    total = parseContentRange(response.headers.get('Content-Range'))
+    with open(partPath, "ab" if offset else "wb") as output:
+      async for chunk in response.aiter_bytes(chunkSize):
+        output.write(chunk)
+        metrics.inc('bytes_total', len(chunk), stage=stage)
+
+  if total and os.path.getsize(partPath) < total:
+    raise IOError(f"Incomplete download: {os.path.getsize(partPath)}/{total} bytes")
+  os.replace(partPath, path)
+
+async def manuallySaveVideo(client, url, videoPath, challengeToken=None, limiter=None, slots=None, hostLimiter=None):
   headers = {
-    "Accept": "*/*",
-    "User-Agent": config['app_context']['userAgent'],
-    "Cookie": cookieString,
-    "Range": "bytes=0-",
-    "Accept-Encoding": 'identity;q=1, *;q=0',
-    "Referer": 'https://www.tiktok.com/'
+    "Cookie": cookieHeader(client, tt_chain_token=challengeToken),
+    "Accept-Encoding": 'identity;q=1, *;q=0'
   }
 
-  response = httpx.get(url, headers=headers)
+  # Retries resume from the bytes already in the .part file
+  hostSlot = hostLimiter and hostLimiter.get(url)
+  await withRetries(lambda: holdingSlot(slots, lambda: streamToFile(client, url, videoPath, headers), hostSlot), limiter=limiter, stage='saveVideo')
+
+async def fetchImage(client, url):
+  metrics.inc('requests_total', stage='savePhotos')
+  response = await client.get(url)
   response.raise_for_status()
+  metrics.inc('bytes_total', len(response.content), stage='savePhotos')
   return response.content
 
-async def savePhotos(imagePost, slideShowPath, saveLog):
+async def fetchFromMirrors(client, urls, hedgeDelay=None):
+  remaining = list(urls)
+  pending = set()
+  lastError = ValueError("No image URLs")
+  try:
+    while remaining or pending:
+      if remaining:
+        pending.add(asyncio.create_task(fetchImage(client, remaining.pop(0))))
+      # Without hedging wait for the current mirror, otherwise race the next one after hedgeDelay
+      timeout = hedgeDelay if remaining and hedgeDelay is not None else None
+      done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+      for task in done:
+        if task.exception() is None:
+          return task.result()
+        lastError = task.exception()
+  finally:
+    for task in pending: task.cancel()
+  raise lastError
+
+async def savePhotos(client, imagePost, slideShowPath, saveLog, config=None, store=None, limiter=None):
   images = imagePost['images']
+  digests = [None] * len(images)
   os.makedirs(slideShowPath, exist_ok=True)
+  semaphore = asyncio.Semaphore(getOption(config, 'imageConcurrency'))
+  hedgeDelay = getOption(config, 'hedgeDelay')
+  print(saveLog)
 
-  for i, image in enumerate(images):
+  async def saveImage(i, image):
     imagePath = os.path.join(slideShowPath, f"image-{i+1}.jpg")
-    if skipDuplicatePhotos(imagePath, 1):
+    if os.path.exists(imagePath):
       print(f"\nAlready saved - {imagePath}")
-      continue
-
-    # Download photos
-    print(saveLog)
-    urls = image['imageURL']['urlList']
-    for url in urls:
-      try:
-        response = httpx.get(url)
-        response.raise_for_status()
-        with open(imagePath, "wb") as f:
-          f.write(response.content)
-        await asyncio.sleep(0.5)
-        break
-      except Exception:
-        continue
-
-def saveMetadata(metaPath, item):
-  metadata = {
-    "author": item['author'],
-    "contents": item['contents'],
-    "createTime": item['createTime'],
-    "desc": item['desc'],
-    "id": item['id'],
-    "music": item['music'],
-    "stats": item['stats'],
-    "video": item['video']
-  }
-
+    else:
+      # Download photos
+      async with semaphore:
+        content = await fetchFromMirrors(client, image['imageURL']['urlList'], hedgeDelay)
+      with open(f"{imagePath}.part", "wb") as f:
+        f.write(content)
+      os.replace(f"{imagePath}.part", imagePath)
+    if store:
+      digests[i] = await asyncio.to_thread(store.absorbImage, imagePath)
+
+  with metrics.timed('savePhotos'):
+    results = await asyncio.gather(
+      *(saveImage(i, image) for i, image in enumerate(images)),
+      return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+      if limiter: limiter.report(errors[0])
+      raise IOError(f"{len(errors)}/{len(images)} slideshow images failed: {errors[0]}")
+  return digests
+
+def itemMetadata(item, soundPath=None, variant=None):
+  metadata = item.toDict()
+  if soundPath: metadata['sound'] = soundPath
+  if variant: metadata['variant'] = variant
+  return metadata
+
+def saveMetadata(metaPath, metadata):
   with open(metaPath, "w", encoding='utf-8') as f:
     json.dump(metadata, f, indent=2, ensure_ascii=False)
 
-def parseVideoInfo(response, id):
-  # Try SIGI_STATE first
-  sigiData = extractJsonFromScript(response.text, "SIGI_STATE")
-  if sigiData: return sigiData["ItemModule"][id]
-
-  # Fall back to UNIVERSAL_DATA
-  universalData = extractJsonFromScript(response.text, "__UNIVERSAL_DATA_FOR_REHYDRATION__")
-  if universalData:
-    defaultScope = universalData.get("__DEFAULT_SCOPE__", {})
-    videoDetail = defaultScope.get("webapp.video-detail", {})
-
-    if videoDetail.get("statusCode", 0) != 0:
-      raise ValueError(f"Invalid video detail response. Status code: {response.status_code}")
+SCRIPT_IDS = ("SIGI_STATE", "__UNIVERSAL_DATA_FOR_REHYDRATION__")
+SCRIPT_PATTERN = re.compile(r'<script id="(SIGI_STATE|__UNIVERSAL_DATA_FOR_REHYDRATION__)" type="application/json">')
+SCRIPT_END = "</script>"
+MARKER_OVERLAP = max(len(f'<script id="{scriptId}" type="application/json">') for scriptId in SCRIPT_IDS)
+
+async def readEmbeddedJson(response):
+  # Single pass over the streamed page, stopping as soon as the data script closes.
+  # Each chunk is searched once, with a few carried-over characters for markers split across chunks
+  head = ""
+  parts = []
+  size = 0
+  carry = ""
+  scriptId = None
+  async for chunk in response.aiter_text():
+    if scriptId is None:
+      head = head[-MARKER_OVERLAP:] + chunk
+      match = SCRIPT_PATTERN.search(head)
+      if not match: continue
+      scriptId = match.group(1)
+      chunk = head[match.end():]
+    end = (carry + chunk).find(SCRIPT_END)
+    if end != -1:
+      # Absolute position of the marker within the script body
+      end += size - len(carry)
+      return scriptId, "".join(parts + [chunk])[:end]
+    parts.append(chunk)
+    size += len(chunk)
+    carry = (carry + chunk)[-(len(SCRIPT_END) - 1):]
+  return scriptId, None
+
+def extractSubObject(text, key):
+  # Decode only the value of the first "key": in the blob
+  start = text.find(f'"{key}":')
+  if start == -1: return None
+  start += len(key) + 3
+  while text[start].isspace(): start += 1
+  return jsonDecoder.raw_decode(text, start)[0]
 
-    return videoDetail.get("itemInfo", {}).get("itemStruct")
+def parseVideoInfo(scriptId, body, id, statusCode=None):
+  if body is None:
+    raise ValueError(f"No valid video data found. Status code: {statusCode}")
 
-  raise ValueError(f"No valid video data found. Status code: {response.status_code}")
+  if scriptId == "SIGI_STATE":
+    itemModule = extractSubObject(body, "ItemModule")
+    if itemModule is None: itemModule = json.loads(body)["ItemModule"]
+    return itemModule[id]
 
-def extractJsonFromScript(htmlText, scriptId):
-  start = htmlText.find(f'<script id="{scriptId}" type="application/json">')
-  if start == -1: return None
+  videoDetail = extractSubObject(body, "webapp.video-detail")
+  if videoDetail is None:
+    videoDetail = json.loads(body).get("__DEFAULT_SCOPE__", {}).get("webapp.video-detail", {})
 
-  start += len(f'<script id="{scriptId}" type="application/json">')
-  end = htmlText.find("</script>", start)
+  if videoDetail.get("statusCode", 0) != 0:
+    raise ValueError(f"Invalid video detail response. Status code: {statusCode}")
 
-  if end == -1: return None
-  return json.loads(htmlText[start:end])
+  return videoDetail.get("itemInfo", {}).get("itemStruct")
 
 def getSessionCookie(cookies):
   for cookie in cookies:
@@ -178,113 +400,264 @@ def getSessionCookie(cookies):
       return cookie
   return None
 
-def manualFetch(url):
-  config = loadConfig()
-  msToken, sessionId = getAuthTokens(config['cookies'])
-
-  headers = {
-    "Accept": "*/*",
-    "User-Agent": config['app_context']['userAgent'],
-    "Cookie": f"sessionid={sessionId}; msToken={msToken}"
-  }
-
-  response = httpx.get(url, headers=headers)
-  response.raise_for_status()
-  challengeToken = response.cookies.get('tt_chain_token')
-
-  videoId = getIdFromUrl(url)
-  videoInfo = parseVideoInfo(response, videoId)
+async def manualFetch(client, url):
+  with metrics.timed('manualFetch'):
+    metrics.inc('requests_total', stage='manualFetch')
+    async with client.stream("GET", url) as response:
+      response.raise_for_status()
+      challengeToken = response.cookies.get('tt_chain_token')
+      scriptId, body = await readEmbeddedJson(response)
+      metrics.inc('bytes_total', response.num_bytes_downloaded, stage='manualFetch')
+
+    videoId = getIdFromUrl(url)
+    videoInfo = parseVideoInfo(scriptId, body, videoId, response.status_code)
   videoInfo['tt_chain_token'] = challengeToken
+  videoInfo['tokenIssuedAt'] = time.time()
   return videoInfo
 
-async def downloadCollectionVideos(collectionData, config=None):
+class HostLimiter:
+  def __init__(self, limit):
+    self.limit = limit
+    self.semaphores = {}
+
+  def get(self, url):
+    host = urlsplit(url).hostname or ''
+    if host not in self.semaphores:
+      self.semaphores[host] = asyncio.Semaphore(self.limit)
+    return self.semaphores[host]
+
+def enqueueItem(ctx, collectionName, item):
+  # Pipelined listing can hand over the same item more than once
+  key = (collectionName, item.id)
+  if key in ctx.queued: return
+  ctx.queued.add(key)
+  if ctx.sounds: ctx.sounds.add(item.music)
+
+  # Finished items are settled from the upfront scan, without touching the network
+  state, kind, path = ctx.planner.classify(collectionName, item)
+  if state == COMPLETE:
+    skipItem(ctx, collectionName, item, kind, path)
+    return
+
+  collectionPath = ctx.collectionPaths.get(collectionName)
+  if collectionPath is None:
+    collectionPath = os.path.join(ctx.outputDir, 'Collections', collectionName)
+    os.makedirs(collectionPath, exist_ok=True)
+    ctx.collectionPaths[collectionName] = collectionPath
+
+  ctx.total += 1
+  ctx.queue.put_nowait((ctx.total, collectionName, collectionPath, item))
+  ctx.progress.total = ctx.total
+  ctx.progress.refresh()
+
+def skipItem(ctx, collectionName, item, kind, path):
+  if (item.id, collectionName) not in ctx.planner.rows:
+    ctx.manifest.record(item.id, collectionName, path, 'complete', kind)  # Found on disk only
+  if kind == 'video':
+    linkFile(path, ctx.store.videoPath(item.id))  # Seed the store from earlier runs
+  ctx.skipped += 1
+  ctx.saved.add(item.id)
+  metrics.inc('items_total', result='skipped')
+
+async def fetchThrottled(ctx, url, preferBrowser=False):
+  await ctx.limiter.acquire()
+  return await fetchVideo(ctx.browser, ctx.client, url, preferBrowser, ctx.hostLimiter)
+
+async def downloadItem(ctx, job):
+  index, collectionName, collectionPath, item = job
+  videoId = item.id
+  authorId = item.author.uniqueId
+  filenameBase = itemFilenameBase(item)
+  url = f"{getOption(ctx.config, 'baseUrl')}/@{authorId}/video/{videoId}"
+  videoPath = os.path.join(collectionPath, f"{filenameBase}.mp4")
+  photoPath = os.path.splitext(videoPath)[0]
+  store, manifest = ctx.store, ctx.manifest
+  strategy = ctx.strategies.get(videoId, DEFAULT_STRATEGY)
+  info = None
+  variant = None
+
+  try:
+    # One worker per video id, so copies in other collections link instead of refetching
+    async with store.lock(videoId):
+      if store.linkVideo(videoId, videoPath):
+        print(f"\nLinked from store - {collectionName}/{filenameBase[:40]}")
+        path, kind, checksum, result = videoPath, 'video', None, 'linked'
+      elif store.linkSlideshow(videoId, photoPath):
+        print(f"\nLinked from store - {collectionName}/{filenameBase[:40]}")
+        path, kind, checksum, result = photoPath, 'slideshow', None, 'linked'
+      else:
+        info = await withRetries(lambda: fetchThrottled(ctx, url, strategy['preferBrowser']), strategy['maxRetries'], ctx.limiter, stage='fetchVideo')
+        imagePost = info.get('imagePost')
+
+        if imagePost:
+          # Save photo
+          saveLog = f"\nSaving slideshow {index}/{ctx.total} - {collectionName}/{filenameBase[:40]}"
+          firstUrl = next(iter(imagePost['images'][0]['imageURL']['urlList']), '')
+          # Download slots may be shared with other accounts' processes; only transfers hold one
+          async with ctx.hostLimiter.get(firstUrl), ctx.slots:
+            digests = await savePhotos(ctx.client, imagePost, photoPath, saveLog, ctx.config, store, ctx.limiter)
+          store.saveSlideshow(videoId, digests)
+          result = 'downloaded'
+          path, kind, checksum = photoPath, 'slideshow', hashlib.sha256(''.join(digests).encode()).hexdigest()
+        else:
+          # Save video
+          saveLog = f"\nSaving video {index}/{ctx.total} - {collectionName}/{filenameBase[:40]}"
+          manifest.record(videoId, collectionName, videoPath, 'downloading', 'video')
+          variant = applyQualityPolicy(info, ctx.quality)
+          source = await saveVideo(ctx.client, ctx.browser, url, store.videoPath(videoId), info, saveLog, ctx.limiter,
+                                   strategy['preferBrowser'], ctx.slots, ctx.hostLimiter)
+          linkFile(store.videoPath(videoId), videoPath)
+          path, kind, result = videoPath, 'video', 'downloaded'
+          if variant and source == 'http':
+            variant['size'] = pathSize(videoPath)
+            metrics.inc('variants_total', codec=variant['codec'])
+          else:
+            variant = None
+          checksum = await asyncio.to_thread(hashFile, videoPath)
+
+    # Save metadata
+    metadata = itemMetadata(item, soundReference(item.music) if ctx.sounds else None, variant)
+    with metrics.timed('saveMetadata'):
+      if ctx.metadataFiles: saveMetadata(os.path.join(collectionPath, f"{filenameBase}.json"), metadata)
+      if ctx.metadataIndex: ctx.metadataIndex.record(collectionName, path, metadata)
+    manifest.record(videoId, collectionName, path, 'complete', kind, pathSize(path), checksum)
+    ctx.saved.add(videoId)
+    metrics.inc('items_total', result=result)
+
+  except Exception as e:
+    print(f"\nError downloading video {url}: {str(e)}")
+    manifest.record(videoId, collectionName, videoPath, 'failed')
+    errorClass = classifyError(e, 'save' if info else 'fetch', info)
+    metrics.inc('items_total', result='failed')
+    metrics.inc('download_failures_total', cause=errorClass)
+    ctx.failures[videoId] = {
+      "collection": collectionName,
+      "class": errorClass,
+      "error": str(e),
+      "metadata": item
+    }
+    # Only add info if it exists
+    if info: ctx.failures[videoId]["video"] = info
+
+def pathSize(path):
+  if os.path.isdir(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+  return os.path.getsize(path)
+
+async def downloadWorker(ctx):
+  liveSummary = getOption(ctx.config, 'liveSummary')
+  while True:
+    job = await ctx.queue.get()
+    if job is None: return
+    await downloadItem(ctx, job)
+    if liveSummary: ctx.progress.set_postfix_str(metrics.summary(), refresh=False)
+    ctx.progress.update(1)
+
+def openDownloads(client, config, limiter=None, browser=None, slots=None, strategies=None):
+  # Workers start right away and pick up items as they are queued
+  from tqdm import tqdm
+  outputDir = getOutputDir(config)
+  os.makedirs(os.path.join(outputDir, "logs"), exist_ok=True)
+
+  # Workers share one queue, one host limiter and one progress bar
+  ctx = SimpleNamespace(
+    browser=browser or BrowserPool(config),
+    ownBrowser=browser is None,
+    client=client,
+    limiter=limiter or createRateLimiter(config),
+    config=config,
+    outputDir=outputDir,
+    queue=asyncio.Queue(),
+    queued=set(),
+    collectionPaths={},
+    total=0,
+    hostLimiter=HostLimiter(getOption(config, 'perHostLimit')),
+    store=ContentStore(outputDir),
+    manifest=openManifest(outputDir),
+    slots=slots or nullcontext(),
+    failures={},
+    saved=set(),
+    strategies=strategies or {},
+    skipped=0,
+    progress=tqdm(total=0)
+  )
+  ctx.planner = DownloadPlanner(outputDir, ctx.manifest)
+  ctx.quality = qualityPolicy(config)
+  # Per-item JSON files can be turned off once the index holds the metadata
+  ctx.metadataFiles = getOption(config, 'metadataFiles')
+  ctx.metadataIndex = None
+  if getOption(config, 'metadataIndex') or not ctx.metadataFiles:
+    ctx.metadataIndex = openMetadataIndex(outputDir)
+  elif os.path.exists(os.path.join(outputDir, "metadata.db")):
+    ctx.metadataIndex = MetadataIndex(outputDir)  # Built by an earlier query, kept current from here on
+  ctx.sounds = None
+  if getOption(config, 'saveSounds'):
+    ctx.sounds = SoundStage(client, config, outputDir, streamToFile)
+  ctx.workers = [asyncio.create_task(downloadWorker(ctx)) for _ in range(getOption(config, 'concurrency'))]
+  return ctx
+
+async def closeDownloads(ctx):
+  # Lets the workers drain the queue, then writes the run logs
+  try:
+    for _ in ctx.workers: ctx.queue.put_nowait(None)
+    try:
+      await asyncio.gather(*ctx.workers)
+      # Sounds drain after the videos, on their own workers
+      if ctx.sounds: await ctx.sounds.close()
+    finally:
+      ctx.progress.close()
+      ctx.manifest.close()
+      if ctx.metadataIndex: ctx.metadataIndex.close()
+
+    print(f"\nDownloaded {ctx.total - len(ctx.failures)}, failed {len(ctx.failures)}, already saved {ctx.skipped}")
+    if ctx.sounds: print(ctx.sounds.summary())
+
+    # Failures accumulate across runs until the item is saved
+    failureLog = FailureLog(ctx.outputDir)
+    failureLog.resolve(ctx.saved - set(ctx.failures))
+    failureLog.merge(ctx.failures)
+    failureLog.save(toJson)
+
+    # Browser session counters, when the fallback was needed
+    sessionStats = ctx.browser.stats()
+    if any(stats['requests'] for stats in sessionStats):
+      with open(os.path.join(ctx.outputDir, "logs", "browser_sessions.json"), "w", encoding='utf-8') as f:
+        json.dump(sessionStats, f, indent=2)
+  finally:
+    if ctx.ownBrowser: await ctx.browser.close()
+
+async def downloadCollectionVideos(client, collectionData, config=None, limiter=None, browser=None, slots=None, strategies=None):
   if not config:
     config = loadConfig()
-  cookies = config['cookies']
-  msToken, _s = getAuthTokens(cookies)
-  id = config['app_context']['user']['uniqueId']
-  print(f"Downloading {id}'s collections")
-
-  async with TikTokApi() as api:
-    await api.create_sessions(ms_tokens=[msToken], num_sessions=1, sleep_after=5)
-    # Create output directory
-    outputDir = f"{id}-tiktok-collection"
-    os.makedirs(outputDir, exist_ok=True)
-    os.makedirs(os.path.join(outputDir, "logs"), exist_ok=True)
-
-    index = 0
-    failures = {}
-    total = sum(len(collection.get('itemList', []))
-      for collection in collectionData['collections'])
+  print(f"Downloading {config['app_context']['user']['uniqueId']}'s collections")
 
+  ctx = openDownloads(client, config, limiter, browser, slots, strategies)
+  try:
     for collection in collectionData['collections']:
-      collectionName = collection['name']
-      collectionPath = os.path.join(outputDir, 'Collections', collectionName)
-      os.makedirs(collectionPath, exist_ok=True)
-      print(f"\nSaving {collectionName} collection")
-
-      for item in tqdm(collection.get('itemList', [])):
-        index += 1
-        videoId = item['id']
-        authorId = item['author']['uniqueId']
-        desc = cleanFilename(item['desc'])
-        createTime = datetime.fromtimestamp(item['createTime']).strftime('%m-%d-%Y')
-        filenameBase = f"{authorId} - {desc} - {createTime}"
-        url = f"https://www.tiktok.com/@{authorId}/video/{videoId}"
-
-        try:
-          video, info = await withRetries(lambda: fetchVideo(api, url))
-          videoPath = os.path.join(collectionPath, f"{filenameBase}.mp4")
-          imagePost = info.get('imagePost')
-
-          if imagePost:
-            # Save photo
-            photoPath = os.path.splitext(videoPath)[0]
-            if skipDuplicatePhotos(photoPath, len(imagePost['images'])):
-              print(f"\nAlready saved - {collectionName}/{filenameBase[:40]}")
-              continue
-            saveLog = f"\nSaving slideshow {index}/{total} - {collectionName}/{filenameBase[:40]}"
-            await savePhotos(imagePost, photoPath, saveLog)
-          else:
-            # Save video
-            if skipDuplicateVideos(videoPath):
-              print(f"\nAlready saved - {collectionName}/{filenameBase[:40]}")
-              continue
-            saveLog = f"\nSaving video {index}/{total} - {collectionName}/{filenameBase[:40]}"
-            await saveVideo(video, videoPath, info, saveLog)
-
-          # Save metadata
-          metaPath = os.path.join(collectionPath, f"{filenameBase}.json")
-          saveMetadata(metaPath, item)
-          time.sleep(1)  # Rate limiting
-
-        except Exception as e:
-          print(f"\nError downloading video {url}: {str(e)}")
-          failures[videoId] = {
-            "collection": collectionName,
-            "error": str(e),
-            "metadata": item
-          }
-          # Only add info if it exists
-          if 'info' in locals(): failures[videoId]["video"] = info
-
-    # Save failures log
-    if failures:
-      failuresPath = os.path.join(outputDir, "logs", "download_failures.json")
-      with open(failuresPath, "w", encoding='utf-8') as f:
-        json.dump(failures, f, indent=2, ensure_ascii=False)
+      for item in collection.get('itemList', []):
+        enqueueItem(ctx, collection['name'], item)
+  finally:
+    await closeDownloads(ctx)
+  return ctx.failures
 
 if __name__ == "__main__":
   import sys
 
   if len(sys.argv) < 2 or len(sys.argv) > 3:
-    print("Usage: python download.py <collection_json_file> <output_directory>")
+    print("Usage: python download.py <collection_json_file> [config_file]")
     sys.exit(1)
 
   collectionFile = sys.argv[1]
-  config = sys.argv[2] if len(sys.argv) == 3 else None
+  config = loadConfig(sys.argv[2]) if len(sys.argv) == 3 else loadConfig()
 
   with open(collectionFile, 'r', encoding='utf-8') as f:
-    collectionData = json.load(f)
+    collectionData = loadCollections(json.load(f))
+
+  async def run(config):
+    try:
+      async with createClient(config) as client:
+        await downloadCollectionVideos(client, collectionData, config)
+    finally:
+      exportMetrics(config, getOutputDir(config))
 
-  asyncio.run(downloadCollectionVideos(collectionData, config))
\ No newline at end of file
+  asyncio.run(run(config))
\ No newline at end of file
@@ -0,0 +1,119 @@
+import json
+import os
+import time
+
+FAILURES_FILE = "download_failures.json"
+
+# Error classes, and how a retry pass treats each of them
+CLASSIFIED = 'classified'        # private, deleted or region-locked: the page says so
+CDN_FORBIDDEN = 'cdn_403'        # the media host refused the plain HTTP download
+EXPIRED_TOKEN = 'expired_token'  # tt_chain_token was rejected; a fresh page visit issues a new one
+BLOCKED = 'blocked'              # the video page came back without data (captcha or bot check)
+THROTTLED = 'throttled'
+NETWORK = 'network'
+CORRUPT = 'corrupt'              # saved, but verify found it broken
+OTHER = 'other'
+
+# A save that fails this long after the video page issued its token is blamed on the token
+TOKEN_MAX_AGE = 300
+
+RETRY_STRATEGIES = {
+  CLASSIFIED: None,
+  CDN_FORBIDDEN: { "preferBrowser": True, "maxRetries": 3 },
+  EXPIRED_TOKEN: { "preferBrowser": False, "maxRetries": 3 },
+  BLOCKED: { "preferBrowser": True, "maxRetries": 3 },
+  THROTTLED: { "preferBrowser": False, "maxRetries": 5 },
+  NETWORK: { "preferBrowser": False, "maxRetries": 5 },
+  CORRUPT: { "preferBrowser": False, "maxRetries": 3 },
+  OTHER: { "preferBrowser": False, "maxRetries": 3 }
+}
+
+def rootError(error):
+  # Fallbacks raise from inside an except block, so the first failure sits at the end of __context__
+  while error.__context__ is not None and error.__context__ is not error:
+    error = error.__context__
+  return error
+
+def statusOf(error):
+  response = getattr(error, 'response', None)
+  return getattr(response, 'status_code', None)
+
+def isCaptcha(error):
+  return type(error).__name__ == 'CaptchaException' or 'captcha' in str(error).lower()
+
+def tokenAge(info):
+  issuedAt = (info or {}).get('tokenIssuedAt')
+  return time.time() - issuedAt if issuedAt else 0
+
+def classifyError(error, stage, info=None):
+  # stage is 'fetch' while getting the video page, 'save' once bytes are being downloaded
+  import httpx
+  root = rootError(error)
+  for candidate in (root, error):
+    status = statusOf(candidate)
+    message = str(candidate)
+    if status == 429: return THROTTLED
+    # A 404 from the CDN is an expired download URL, not a removed video
+    if (status == 404 and stage == 'fetch') or "Invalid video detail" in message: return CLASSIFIED
+    if status in (401, 403):
+      if stage == 'fetch': return BLOCKED
+      return EXPIRED_TOKEN if tokenAge(info) > TOKEN_MAX_AGE else CDN_FORBIDDEN
+    if "No valid video data" in message or isCaptcha(candidate): return BLOCKED
+    if isinstance(candidate, (httpx.TimeoutException, httpx.TransportError)): return NETWORK
+    if isinstance(candidate, OSError) and "Incomplete download" in message: return NETWORK
+  return OTHER
+
+class FailureLog:
+  # Failures merged across runs, keyed by video id; an entry goes away once the item is saved
+  def __init__(self, outputDir):
+    self.path = os.path.join(outputDir, "logs", FAILURES_FILE)
+    self.entries = {}
+    if os.path.exists(self.path):
+      try:
+        with open(self.path, "r", encoding="utf-8") as f:
+          self.entries = json.load(f)
+      except (OSError, ValueError):
+        self.entries = {}
+
+  def merge(self, failures):
+    now = int(time.time())
+    for videoId, failure in failures.items():
+      previous = self.entries.get(videoId, {})
+      collections = previous.get('collections', [previous['collection']] if 'collection' in previous else [])
+      if failure['collection'] not in collections: collections.append(failure['collection'])
+      self.entries[videoId] = {
+        **previous,
+        **failure,
+        "class": failure.get('class', OTHER),
+        "collections": collections,
+        "attempts": previous.get('attempts', 1 if previous else 0) + 1,
+        "firstFailedAt": previous.get('firstFailedAt', now),
+        "lastFailedAt": now
+      }
+
+  def resolve(self, videoIds):
+    for videoId in videoIds:
+      self.entries.pop(videoId, None)
+
+  def select(self, classes=None, includeClassified=False):
+    selected = {}
+    for videoId, entry in self.entries.items():
+      errorClass = entry.get('class', OTHER)
+      if classes and errorClass not in classes: continue
+      # Classified items are only retried when asked for by name
+      if RETRY_STRATEGIES.get(errorClass, RETRY_STRATEGIES[OTHER]) is None and not (includeClassified or classes): continue
+      selected[videoId] = entry
+    return selected
+
+  def save(self, toJson=None):
+    if not self.entries:
+      if os.path.exists(self.path): os.remove(self.path)
+      return
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    tmpPath = f"{self.path}.tmp"
+    with open(tmpPath, "w", encoding="utf-8") as f:
+      json.dump(self.entries, f, indent=2, ensure_ascii=False, default=toJson)
+    os.replace(tmpPath, self.path)
+
+def strategyFor(entry):
+  return RETRY_STRATEGIES.get(entry.get('class', OTHER)) or RETRY_STRATEGIES[OTHER]
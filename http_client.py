@@ -0,0 +1,45 @@
+import httpx
+from urllib.parse import urlsplit
+from tiktok import getAuthTokens, getOption
+
+try:
+  import h2  # noqa: F401 - enables HTTP/2 in httpx
+  HTTP2 = True
+except ImportError:
+  HTTP2 = False
+
+def cookieDomain(baseUrl):
+  host = urlsplit(baseUrl).hostname or ''
+  return f".{host[len('www.'):]}" if host.startswith('www.') else host
+
+def createClient(config):
+  msToken, sessionId = getAuthTokens(config['cookies'])
+  # Session cookies only go to the site itself, never to CDN image mirrors or sound hosts;
+  # video downloads that need them pass them explicitly with cookieHeader
+  cookies = httpx.Cookies()
+  domain = cookieDomain(getOption(config, 'baseUrl'))
+  cookies.set("sessionid", sessionId, domain=domain)
+  cookies.set("msToken", msToken, domain=domain)
+  limits = httpx.Limits(
+    max_connections=getOption(config, 'maxConnections'),
+    max_keepalive_connections=getOption(config, 'maxKeepalive'),
+    keepalive_expiry=getOption(config, 'keepaliveExpiry')
+  )
+  headers = {
+    "Accept": "*/*",
+    "User-Agent": config['app_context']['userAgent'],
+    "Referer": "https://www.tiktok.com/"
+  }
+
+  return httpx.AsyncClient(
+    http2=HTTP2,
+    limits=limits,
+    headers=headers,
+    cookies=cookies,
+    timeout=httpx.Timeout(10, read=30),
+    follow_redirects=True
+  )
+
+def cookieHeader(client, **extra):
+  cookies = { **{ cookie.name: cookie.value for cookie in client.cookies.jar }, **extra }
+  return "; ".join(f"{name}={value}" for name, value in cookies.items() if value)
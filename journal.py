@@ -0,0 +1,78 @@
+import json
+import os
+from models import toJson
+
+class ListingJournal:
+  # Append-only JSONL log of fetched pages, one line per page
+  def __init__(self, path):
+    self.path = path
+    self.pageOffsets = {}
+    self.state = self.load()
+    self.file = open(path, 'ab')
+
+  def load(self):
+    state = {}
+    if not os.path.exists(self.path): return state
+
+    offset = 0
+    with open(self.path, 'rb') as f:
+      for line in f:
+        try:
+          entry = json.loads(line)
+        except ValueError:
+          break  # Torn last line from a crash
+        self.track(entry, offset)
+        offset += len(line)
+        key = entry['collectionId']
+        if entry.get('reset') or key not in state:
+          state[key] = { 'cursor': 0, 'hasMore': True, 'items': [], 'full': bool(entry.get('reset')) }
+        if 'items' in entry:
+          state[key]['items'].extend(entry['items'])
+          state[key]['cursor'] = entry['nextCursor']
+          state[key]['hasMore'] = entry['hasMore']
+
+    if offset < os.path.getsize(self.path):
+      os.truncate(self.path, offset)
+    return state
+
+  def resume(self, key):
+    return self.state.get(key)
+
+  def track(self, entry, offset):
+    # Line offsets of the pages still current for each key, so items can be streamed back
+    key = entry['collectionId']
+    if entry.get('reset'):
+      self.pageOffsets[key] = []
+    else:
+      self.pageOffsets.setdefault(key, []).append(offset)
+
+  def write(self, entry):
+    self.track(entry, self.file.tell())
+    self.file.write((json.dumps(entry, ensure_ascii=False, default=toJson) + "\n").encode('utf-8'))
+    self.file.flush()
+
+  def append(self, key, cursor, nextCursor, hasMore, items):
+    self.write({
+      'collectionId': key,
+      'cursor': cursor,
+      'nextCursor': nextCursor,
+      'hasMore': hasMore,
+      'items': items
+    })
+
+  def reset(self, key):
+    self.write({ 'collectionId': key, 'reset': True })
+
+  def iterItems(self, key):
+    self.file.flush()
+    with open(self.path, 'rb') as f:
+      for offset in self.pageOffsets.get(key, []):
+        f.seek(offset)
+        yield from json.loads(f.readline())['items']
+
+  def close(self):
+    self.file.close()
+
+  def remove(self):
+    self.close()
+    os.remove(self.path)
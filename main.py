@@ -1,20 +1,75 @@
-from tiktok_collections import getCollectionData, getCollectionItems, getUncategorizedFavorites
-from tiktok import getTiktokData
-from download import downloadCollectionVideos
+from tiktok_collections import getCollectionData, getCollectionItems, getFavorites, getUncategorizedFavorites, UncategorizedFilter, UNCATEGORIZED
+from tiktok import getTiktokData, getOutputDir, getOption, CONFIG_FILE
+from planner import buildPlan, printPlan, openExistingManifest
+from download import downloadCollectionVideos, openDownloads, enqueueItem, closeDownloads
+from http_client import createClient
+from ratelimit import createRateLimiter
+from metrics import metrics, exportMetrics
 import asyncio
 
-def main():
-  config = getTiktokData()
-
-  # Get collections
-  collections = getCollectionData(config)
+async def runPipelined(client, config, limiter, slots=None):
+  # Every listed page goes straight to the download workers
+  collections = await getCollectionData(client, config, limiter)
   collectionData = { "collections": collections }
-  collectionItems = getCollectionItems(config, collectionData)
-  uncategorizedFavorites = getUncategorizedFavorites(collectionItems, config)
+  uncategorized = UncategorizedFilter()
+  downloads = openDownloads(client, config, limiter, slots=slots)
+
+  def onCollectionItems(collection, items):
+    uncategorized.addCollected(items)
+    for item in items: enqueueItem(downloads, collection['name'], item)
+
+  try:
+    await asyncio.gather(
+      getCollectionItems(client, config, collectionData, limiter=limiter, onItems=onCollectionItems),
+      getFavorites(client, config, limiter=limiter, onItems=uncategorized.addFavorites)
+    )
+    print(f"\nListing done - {metrics.summary()}")
+
+    # A favorite is only known to be uncategorized once every collection is listed
+    for item in uncategorized.uncategorized(): enqueueItem(downloads, UNCATEGORIZED, item)
+  finally:
+    await closeDownloads(downloads)
 
-  # Download collections & favorites
-  asyncio.run(downloadCollectionVideos(collectionItems, config))
-  asyncio.run(downloadCollectionVideos(uncategorizedFavorites, config))
+def printDryRun(config, downloads):
+  outputDir = getOutputDir(config)
+  manifest = openExistingManifest(outputDir)
+  try:
+    printPlan(buildPlan(downloads, outputDir, manifest))
+  finally:
+    if manifest: manifest.close()
+
+async def run(config, slots=None, dryRun=False):
+  try:
+    # One pooled client is shared by listing and downloads
+    async with createClient(config) as client:
+      limiter = createRateLimiter(config)
+      if getOption(config, 'pipeline') and not dryRun:
+        await runPipelined(client, config, limiter, slots)
+        return
+
+      # Get collections
+      collections = await getCollectionData(client, config, limiter)
+      collectionData = { "collections": collections }
+      collectionItems = await getCollectionItems(client, config, collectionData, limiter=limiter)
+      uncategorizedFavorites = await getUncategorizedFavorites(client, collectionItems, config, limiter)
+      print(f"\nListing done - {metrics.summary()}")
+
+      # Download collections & favorites in one pass
+      downloads = { "collections": collectionItems['collections'] + uncategorizedFavorites['collections'] }
+      if dryRun:
+        printDryRun(config, downloads)
+        return
+      await downloadCollectionVideos(client, downloads, config, limiter, slots=slots)
+  finally:
+    # Written even when the run fails, so scheduled jobs can alert on it
+    exportMetrics(config, getOutputDir(config))
+
+def main():
+  import sys
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  config = getTiktokData(args[0] if args else CONFIG_FILE)
+  # --dry-run lists as usual, then reports what would be downloaded
+  asyncio.run(run(config, dryRun='--dry-run' in sys.argv))
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import time
+from store import hashFile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+  id TEXT NOT NULL,
+  collection TEXT NOT NULL,
+  path TEXT NOT NULL,
+  kind TEXT,
+  bytes INTEGER,
+  checksum TEXT,
+  status TEXT NOT NULL,
+  createdAt REAL NOT NULL,
+  updatedAt REAL NOT NULL,
+  PRIMARY KEY (id, collection)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+"""
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+class Manifest:
+  def __init__(self, outputDir):
+    self.path = os.path.join(outputDir, "manifest.db")
+    self.db = sqlite3.connect(self.path)
+    self.db.row_factory = sqlite3.Row
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript(SCHEMA)
+
+  def get(self, videoId, collection):
+    return self.db.execute(
+      "SELECT * FROM items WHERE id = ? AND collection = ?", (videoId, collection)
+    ).fetchone()
+
+  def isComplete(self, videoId, collection):
+    row = self.get(videoId, collection)
+    return row is not None and row['status'] == 'complete'
+
+  def record(self, videoId, collection, path, status, kind=None, bytes=None, checksum=None, commit=True):
+    now = time.time()
+    self.db.execute("""
+      INSERT INTO items (id, collection, path, kind, bytes, checksum, status, createdAt, updatedAt)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+      ON CONFLICT (id, collection) DO UPDATE SET
+        path = excluded.path,
+        kind = COALESCE(excluded.kind, kind),
+        bytes = COALESCE(excluded.bytes, bytes),
+        checksum = COALESCE(excluded.checksum, checksum),
+        status = excluded.status,
+        updatedAt = excluded.updatedAt
+    """, (videoId, collection, path, kind, bytes, checksum, status, now, now))
+    if commit: self.db.commit()
+
+  def rows(self):
+    return { (row['id'], row['collection']): row for row in self.db.execute("SELECT * FROM items") }
+
+  def counts(self):
+    rows = self.db.execute("SELECT status, COUNT(*) AS total FROM items GROUP BY status")
+    return { row['status']: row['total'] for row in rows }
+
+  def collectionCounts(self):
+    rows = self.db.execute("""
+      SELECT collection, status, COUNT(*) AS total, COALESCE(SUM(bytes), 0) AS bytes
+      FROM items GROUP BY collection, status
+    """)
+    counts = {}
+    for row in rows:
+      collection = counts.setdefault(row['collection'], { "bytes": 0 })
+      collection[row['status']] = row['total']
+      collection["bytes"] += row['bytes']
+    return counts
+
+  def close(self):
+    self.db.commit()
+    self.db.close()
+
+def openManifest(outputDir):
+  # First run on an existing library seeds the manifest from disk
+  isNew = not os.path.exists(os.path.join(outputDir, "manifest.db"))
+  manifest = Manifest(outputDir)
+  if isNew: rebuildManifest(outputDir, manifest)
+  return manifest
+
+def scanCollection(collectionPath, withChecksum=False):
+  for entry in os.scandir(collectionPath):
+    if not (entry.is_file() and entry.name.endswith('.json')): continue
+    try:
+      with open(entry.path, 'r', encoding='utf-8') as f:
+        videoId = json.load(f)['id']
+    except (OSError, ValueError, KeyError):
+      continue
+
+    # Metadata is only written once the media is saved
+    basePath = entry.path[:-len('.json')]
+    if os.path.isfile(f"{basePath}.mp4"):
+      path = f"{basePath}.mp4"
+      size = os.path.getsize(path)
+      checksum = hashFile(path) if withChecksum else None
+      yield videoId, path, 'video', size, checksum
+    elif os.path.isdir(basePath):
+      images = sorted(f.path for f in os.scandir(basePath) if f.name.lower().endswith(PHOTO_EXTENSIONS))
+      size = sum(os.path.getsize(image) for image in images)
+      yield videoId, basePath, 'slideshow', size, None
+
+def rebuildManifest(outputDir, manifest=None, withChecksum=False):
+  manifest = manifest or Manifest(outputDir)
+  collectionsDir = os.path.join(outputDir, 'Collections')
+  if not os.path.isdir(collectionsDir): return manifest
+
+  total = 0
+  for collection in os.scandir(collectionsDir):
+    if not collection.is_dir(): continue
+    for videoId, path, kind, size, checksum in scanCollection(collection.path, withChecksum):
+      manifest.record(videoId, collection.name, path, 'complete', kind, size, checksum, commit=False)
+      total += 1
+  manifest.db.commit()
+  print(f"Manifest rebuilt from disk: {total} items")
+  return manifest
+
+if __name__ == "__main__":
+  import sys
+
+  if len(sys.argv) < 3 or sys.argv[1] != 'rebuild':
+    print("Usage: python manifest.py rebuild <output_directory> [--checksum]")
+    sys.exit(1)
+
+  rebuildManifest(sys.argv[2], withChecksum='--checksum' in sys.argv).close()
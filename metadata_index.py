@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+  id TEXT PRIMARY KEY,
+  author TEXT,
+  authorId TEXT,
+  createTime INTEGER,
+  desc TEXT,
+  musicId TEXT,
+  musicTitle TEXT,
+  duration INTEGER,
+  playCount INTEGER,
+  diggCount INTEGER,
+  commentCount INTEGER,
+  shareCount INTEGER,
+  collectCount INTEGER,
+  data TEXT NOT NULL,
+  updatedAt REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memberships (
+  id TEXT NOT NULL,
+  collection TEXT NOT NULL,
+  path TEXT NOT NULL,
+  PRIMARY KEY (id, collection)
+);
+CREATE TABLE IF NOT EXISTS settings (
+  key TEXT PRIMARY KEY,
+  value
+);
+CREATE INDEX IF NOT EXISTS items_author ON items (author);
+CREATE INDEX IF NOT EXISTS items_createTime ON items (createTime);
+CREATE INDEX IF NOT EXISTS items_musicId ON items (musicId);
+CREATE INDEX IF NOT EXISTS items_playCount ON items (playCount);
+CREATE INDEX IF NOT EXISTS items_diggCount ON items (diggCount);
+CREATE INDEX IF NOT EXISTS memberships_collection ON memberships (collection);
+CREATE INDEX IF NOT EXISTS memberships_path ON memberships (path);
+"""
+
+SORT_COLUMNS = {
+  "created": "createTime",
+  "plays": "playCount",
+  "likes": "diggCount",
+  "comments": "commentCount",
+  "shares": "shareCount",
+  "saves": "collectCount"
+}
+
+class MetadataIndex:
+  # Every saved item's metadata in one SQLite file, instead of one JSON file per item
+  def __init__(self, outputDir):
+    self.path = os.path.join(outputDir, "metadata.db")
+    self.db = sqlite3.connect(self.path)
+    self.db.row_factory = sqlite3.Row
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript(SCHEMA)
+
+  def record(self, collection, path, metadata, commit=True):
+    author, music, stats = metadata.get('author') or {}, metadata.get('music') or {}, metadata.get('stats') or {}
+    self.db.execute("""
+      INSERT OR REPLACE INTO items (id, author, authorId, createTime, desc, musicId, musicTitle, duration,
+                                    playCount, diggCount, commentCount, shareCount, collectCount, data, updatedAt)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+      metadata['id'], author.get('uniqueId'), author.get('id'), metadata.get('createTime'), metadata.get('desc'),
+      music.get('id') or None, music.get('title'), (metadata.get('video') or {}).get('duration'),
+      stats.get('playCount'), stats.get('diggCount'), stats.get('commentCount'), stats.get('shareCount'), stats.get('collectCount'),
+      json.dumps(metadata, ensure_ascii=False, separators=(',', ':')), time.time()
+    ))
+    self.db.execute("INSERT OR REPLACE INTO memberships (id, collection, path) VALUES (?, ?, ?)", (metadata['id'], collection, path))
+    if commit: self.db.commit()
+
+  def get(self, videoId):
+    row = self.db.execute("SELECT data FROM items WHERE id = ?", (videoId,)).fetchone()
+    return json.loads(row['data']) if row else None
+
+  def byPath(self):
+    # Media path -> metadata, for checks that used to read the JSON next to each file
+    rows = self.db.execute("SELECT memberships.path, items.data FROM memberships JOIN items USING (id)")
+    return { row['path']: row['data'] for row in rows }
+
+  def query(self, author=None, musicId=None, collection=None, since=None, until=None, text=None, sort="created", limit=50):
+    clauses, params = [], []
+    if author:
+      clauses.append("items.author = ?")
+      params.append(author.lstrip('@'))
+    if musicId:
+      clauses.append("items.musicId = ?")
+      params.append(musicId)
+    if collection:
+      clauses.append("items.id IN (SELECT id FROM memberships WHERE collection = ?)")
+      params.append(collection)
+    if since is not None:
+      clauses.append("items.createTime >= ?")
+      params.append(since)
+    if until is not None:
+      clauses.append("items.createTime < ?")
+      params.append(until)
+    if text:
+      clauses.append("items.desc LIKE ?")
+      params.append(f"%{text}%")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = self.db.execute(f"""
+      SELECT items.*, (SELECT json_group_array(path) FROM memberships WHERE memberships.id = items.id) AS paths
+      FROM items {where}
+      ORDER BY items.{SORT_COLUMNS[sort]} DESC
+      LIMIT ?
+    """, (*params, limit))
+    return [{ **json.loads(row['data']), "paths": json.loads(row['paths']) } for row in rows]
+
+  def lastImport(self):
+    row = self.db.execute("SELECT value FROM settings WHERE key = 'lastImport'").fetchone()
+    return row['value'] if row else 0
+
+  def setLastImport(self, timestamp):
+    self.db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('lastImport', ?)", (timestamp,))
+    self.db.commit()
+
+  def count(self):
+    return self.db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+  def close(self):
+    self.db.commit()
+    self.db.close()
+
+def openMetadataIndex(outputDir):
+  # Imports per-item JSON files written since the last import, all of them on first use
+  index = MetadataIndex(outputDir)
+  importMetadataFiles(outputDir, index, index.lastImport())
+  return index
+
+def importMetadataFiles(outputDir, index, since=0):
+  collectionsDir = os.path.join(outputDir, 'Collections')
+  if not os.path.isdir(collectionsDir): return index
+
+  started = time.time()
+  total = 0
+  for collection in os.scandir(collectionsDir):
+    if not collection.is_dir(): continue
+    for entry in os.scandir(collection.path):
+      if not (entry.is_file() and entry.name.endswith('.json')): continue
+      if entry.stat().st_mtime < since: continue
+      basePath = entry.path[:-len('.json')]
+      path = f"{basePath}.mp4" if os.path.isfile(f"{basePath}.mp4") else basePath
+      if not os.path.exists(path): continue  # Metadata is only written once the media is saved
+      try:
+        with open(entry.path, 'r', encoding='utf-8') as f:
+          index.record(collection.name, path, json.load(f), commit=False)
+      except (OSError, ValueError, KeyError):
+        continue
+      total += 1
+  index.setLastImport(started)
+  if total or not since: print(f"Metadata index updated from disk: {total} items")
+  return index
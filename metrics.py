@@ -0,0 +1,178 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from tiktok import getOption
+from failures import isCaptcha
+
+PREFIX = "tiktok_collections"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def labelKey(labels):
+  return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def formatLabels(key, extra=()):
+  pairs = [*key, *extra]
+  if not pairs: return ""
+  return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def errorCause(error):
+  # Coarse buckets, so retry and failure counters stay low-cardinality
+  import httpx
+  if isinstance(error, httpx.HTTPStatusError):
+    return f"http_{error.response.status_code}"
+  if isinstance(error, httpx.TimeoutException): return "timeout"
+  if isinstance(error, httpx.TransportError): return "network"
+  if isCaptcha(error): return "captcha"
+  if isinstance(error, (ValueError, KeyError, TypeError)): return "parse"
+  if isinstance(error, OSError): return "io"
+  return type(error).__name__
+
+class Histogram:
+  def __init__(self, buckets=LATENCY_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0
+    self.count = 0
+
+  def observe(self, value):
+    self.sum += value
+    self.count += 1
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+        return
+    self.counts[-1] += 1
+
+  def quantile(self, fraction):
+    # Upper bound of the bucket holding the quantile
+    if not self.count: return None
+    target = fraction * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= target:
+        return self.buckets[i] if i < len(self.buckets) else float("inf")
+
+  def toDict(self):
+    return {
+      "count": self.count,
+      "sum": round(self.sum, 4),
+      "mean": round(self.sum / self.count, 4) if self.count else None,
+      "p50": self.quantile(0.5),
+      "p99": self.quantile(0.99),
+      "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts))
+    }
+
+class Metrics:
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.counters = {}
+    self.histograms = {}
+    self.started = time.time()
+
+  def inc(self, name, value=1, **labels):
+    key = (name, labelKey(labels))
+    self.counters[key] = self.counters.get(key, 0) + value
+
+  def observe(self, name, value, **labels):
+    key = (name, labelKey(labels))
+    if key not in self.histograms:
+      self.histograms[key] = Histogram()
+    self.histograms[key].observe(value)
+
+  def count(self, name, **labels):
+    # Sum over every series matching the given labels
+    wanted = set(labelKey(labels))
+    return sum(value for (counterName, key), value in self.counters.items()
+               if counterName == name and wanted <= set(key))
+
+  @contextmanager
+  def timed(self, stage):
+    started = time.perf_counter()
+    try:
+      yield
+    except Exception as e:
+      self.inc("failures_total", stage=stage, cause=errorCause(e))
+      raise
+    finally:
+      self.observe("stage_duration_seconds", time.perf_counter() - started, stage=stage)
+
+  def retry(self, stage, error):
+    self.inc("retries_total", stage=stage, cause=errorCause(error))
+
+  def report(self):
+    return {
+      "startedAt": self.started,
+      "durationSeconds": round(time.time() - self.started, 3),
+      "counters": [
+        { "name": name, "labels": dict(key), "value": value }
+        for (name, key), value in sorted(self.counters.items())
+      ],
+      "histograms": [
+        { "name": name, "labels": dict(key), **histogram.toDict() }
+        for (name, key), histogram in sorted(self.histograms.items(), key=lambda entry: entry[0])
+      ]
+    }
+
+  def prometheus(self):
+    lines = []
+    typed = set()
+    for (name, key), value in sorted(self.counters.items()):
+      metric = f"{PREFIX}_{name}"
+      if metric not in typed:
+        lines.append(f"# TYPE {metric} counter")
+        typed.add(metric)
+      lines.append(f"{metric}{formatLabels(key)} {value}")
+    for (name, key), histogram in sorted(self.histograms.items(), key=lambda entry: entry[0]):
+      metric = f"{PREFIX}_{name}"
+      if metric not in typed:
+        lines.append(f"# TYPE {metric} histogram")
+        typed.add(metric)
+      cumulative = 0
+      for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+        cumulative += count
+        lines.append(f"{metric}_bucket{formatLabels(key, [('le', bound)])} {cumulative}")
+      lines.append(f"{metric}_sum{formatLabels(key)} {histogram.sum:.6f}")
+      lines.append(f"{metric}_count{formatLabels(key)} {histogram.count}")
+    lines.append(f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{PREFIX}_last_run_timestamp_seconds {time.time():.0f}")
+    lines.append(f"# TYPE {PREFIX}_run_duration_seconds gauge")
+    lines.append(f"{PREFIX}_run_duration_seconds {time.time() - self.started:.3f}")
+    return "\n".join(lines) + "\n"
+
+  def summary(self):
+    elapsed = max(time.time() - self.started, 1e-9)
+    megabytes = self.count("bytes_total") / (1024 * 1024)
+    fetch = self.histograms.get(("stage_duration_seconds", labelKey({ "stage": "fetchVideo" })))
+    p50 = fetch.quantile(0.5) if fetch else None
+    return (
+      f"req {self.count('requests_total')} "
+      f"ok {self.count('items_total', result='downloaded')} "
+      f"skip {self.count('items_total', result='skipped') + self.count('items_total', result='linked')} "
+      f"fail {self.count('items_total', result='failed')} "
+      f"retry {self.count('retries_total')} "
+      f"{megabytes:.1f}MB {megabytes / elapsed:.2f}MB/s"
+      + (f" fetch p50<={p50}s" if p50 is not None else "")
+    )
+
+  def write(self, outputDir, textfilePath=None):
+    # Report next to the logs; the textfile goes wherever node_exporter collects from
+    logsDir = os.path.join(outputDir, "logs")
+    os.makedirs(logsDir, exist_ok=True)
+    writeAtomic(os.path.join(logsDir, "run_report.json"), json.dumps(self.report(), indent=2))
+    writeAtomic(textfilePath or os.path.join(logsDir, f"{PREFIX}.prom"), self.prometheus())
+
+def writeAtomic(path, text):
+  # Scrapers must never see a half-written file
+  tmpPath = f"{path}.tmp"
+  with open(tmpPath, "w", encoding="utf-8") as f:
+    f.write(text)
+  os.replace(tmpPath, path)
+
+metrics = Metrics()
+
+def exportMetrics(config, outputDir):
+  metrics.write(outputDir, getOption(config, 'metricsTextfile'))
@@ -0,0 +1,118 @@
+import sys
+from weakref import WeakValueDictionary
+
+# Authors and sounds used by many items are held once per distinct value: the key is
+# every field, so fresher API data (a new nickname, a re-signed playUrl) gets its own record
+_authors = WeakValueDictionary()
+_music = WeakValueDictionary()
+
+def internRecord(cache, recordClass, data):
+  key = tuple(data.get(name) for name in recordClass.fields)
+  record = cache.get(key)
+  if record is None:
+    record = recordClass(data)
+    cache[key] = record
+  return record
+
+def internString(value):
+  return sys.intern(value) if isinstance(value, str) else value
+
+class Record:
+  __slots__ = ('__weakref__',)
+  fields = ()
+
+  def toDict(self):
+    return { name: getattr(self, name) for name in self.fields }
+
+class Author(Record):
+  __slots__ = ('id', 'nickname', 'secUid', 'signature', 'uniqueId', 'verified')
+  fields = __slots__
+
+  def __init__(self, data):
+    self.id = internString(data['id'])
+    self.nickname = data['nickname']
+    self.secUid = data['secUid']
+    self.signature = data['signature']
+    self.uniqueId = internString(data['uniqueId'])
+    self.verified = data['verified']
+
+class Music(Record):
+  __slots__ = ('authorName', 'duration', 'id', 'original', 'playUrl', 'title')
+  fields = __slots__
+
+  def __init__(self, data):
+    self.authorName = data.get('authorName', '')
+    self.duration = data.get('duration', 0)
+    self.id = internString(data.get('id', ''))
+    self.original = data.get('original', False)
+    self.playUrl = data.get('playUrl', '')
+    self.title = data.get('title', '')
+
+class Stats(Record):
+  __slots__ = ('collectCount', 'commentCount', 'diggCount', 'playCount', 'shareCount')
+  fields = __slots__
+
+  def __init__(self, data):
+    self.collectCount = data.get('collectCount', 0)
+    self.commentCount = data.get('commentCount', 0)
+    self.diggCount = data.get('diggCount', 0)
+    self.playCount = data.get('playCount', 0)
+    self.shareCount = data.get('shareCount', 0)
+
+class Video(Record):
+  __slots__ = ('duration', 'format', 'width', 'height', 'id', 'ratio')
+  fields = __slots__
+
+  def __init__(self, data):
+    self.duration = data.get('duration', 0)
+    self.format = internString(data.get('format', 'mp4'))
+    self.width = data.get('width', 0)
+    self.height = data.get('height', 0)
+    self.id = data['id']
+    self.ratio = internString(data.get('ratio', ''))
+
+class CollectionItem(Record):
+  __slots__ = ('author', 'contents', 'createTime', 'desc', 'id', 'music', 'stats', 'video')
+  fields = __slots__
+
+  def __init__(self, data):
+    author, music = data['author'], data['music']
+    self.author = internRecord(_authors, Author, author)
+    self.contents = data.get('contents', [])
+    self.createTime = data['createTime']
+    self.desc = data['desc']
+    self.id = data['id']
+    self.music = internRecord(_music, Music, music)
+    self.stats = Stats(data['stats'])
+    self.video = Video(data['video'])
+
+  @classmethod
+  def fromDict(cls, data):
+    # Accepts raw API items and saved metadata, which share the same keys.
+    # Always built fresh, so a relisting picks up changed stats and descriptions
+    return cls(data)
+
+  def toDict(self):
+    return {
+      'author': self.author.toDict(),
+      'contents': self.contents,
+      'createTime': self.createTime,
+      'desc': self.desc,
+      'id': self.id,
+      'music': self.music.toDict(),
+      'stats': self.stats.toDict(),
+      'video': self.video.toDict()
+    }
+
+def toJson(value):
+  # json default hook for records nested in plain dicts & lists
+  if isinstance(value, Record): return value.toDict()
+  raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def loadItems(items):
+  return [CollectionItem.fromDict(item) for item in items]
+
+def loadCollections(collectionData):
+  for collection in collectionData.get('collections', []):
+    collection['itemList'] = loadItems(collection.get('itemList', []))
+  return collectionData
@@ -0,0 +1,155 @@
+import os
+from datetime import datetime
+
+NEW = 'new'
+PARTIAL = 'partial'
+COMPLETE = 'complete'
+ORPHANED = 'orphaned'
+
+def cleanFilename(text, maxWords=12, maxLength=60):
+  # Max Words
+  text = text.replace(':', '--')
+  words = text.split()[:maxWords]
+  cleaned = ' '.join(words)
+
+  # Invalid characters
+  invalidChars = '<>:"/\\|?*'
+  for char in invalidChars:
+    cleaned = cleaned.replace(char, '')
+
+  # Max string length
+  if len(cleaned) > maxLength:
+    cleaned = cleaned[:maxLength-3] + '...'
+
+  return cleaned
+
+def itemFilenameBase(item):
+  desc = cleanFilename(item.desc)
+  createTime = datetime.fromtimestamp(item.createTime).strftime('%m-%d-%Y')
+  return f"{item.author.uniqueId} - {desc} - {createTime}"
+
+def scanOutputDir(outputDir):
+  # One pass over Collections/*, noting what exists for each file stem
+  tree = {}
+  collectionsDir = os.path.join(outputDir, 'Collections')
+  if not os.path.isdir(collectionsDir): return tree
+
+  for collection in os.scandir(collectionsDir):
+    if not collection.is_dir(): continue
+    entries = {}
+    for entry in os.scandir(collection.path):
+      name = entry.name
+      if entry.is_dir():
+        stem, kind = name, 'dir'
+      elif name.endswith('.mp4'):
+        stem, kind = name[:-len('.mp4')], 'mp4'
+      elif name.endswith('.json'):
+        stem, kind = name[:-len('.json')], 'json'
+      else:
+        continue
+      entries.setdefault(stem, set()).add(kind)
+    tree[collection.name] = entries
+  return tree
+
+def scanStoreParts(outputDir):
+  # Interrupted video transfers resume from .store/videos/<id>.mp4.part
+  videosDir = os.path.join(outputDir, '.store', 'videos')
+  if not os.path.isdir(videosDir): return set()
+  return { entry.name[:-len('.mp4.part')] for entry in os.scandir(videosDir) if entry.name.endswith('.mp4.part') }
+
+def openExistingManifest(outputDir):
+  # Planning only reads state: without a manifest.db the scan alone decides
+  from manifest import Manifest
+  return Manifest(outputDir) if os.path.exists(os.path.join(outputDir, "manifest.db")) else None
+
+class DownloadPlanner:
+  # Classifies items against one scan of the output tree and the manifest,
+  # so deciding what to skip costs no per-item filesystem or network calls
+  def __init__(self, outputDir, manifest):
+    self.outputDir = outputDir
+    self.tree = scanOutputDir(outputDir)
+    self.storeParts = scanStoreParts(outputDir)
+    self.rows = manifest.rows() if manifest else {}
+    self.claimed = {}
+
+  def classify(self, collectionName, item):
+    stem = itemFilenameBase(item)
+    self.claimed.setdefault(collectionName, set()).add(stem)
+    found = self.tree.get(collectionName, {}).get(stem, set())
+    row = self.rows.get((item.id, collectionName))
+    hasMedia = 'mp4' in found or 'dir' in found
+
+    # A failed row wins over files on disk, e.g. ones verify found corrupt
+    if row and row['status'] in ('downloading', 'failed'):
+      return PARTIAL, None, None
+    if row and row['status'] == 'complete' and (hasMedia or os.path.exists(row['path'])):
+      # Saved under an older name when the description changed since
+      savedStem = os.path.basename(row['path'])
+      self.claimed[collectionName].add(savedStem[:-len('.mp4')] if savedStem.endswith('.mp4') else savedStem)
+      return COMPLETE, row['kind'], row['path']
+    # Metadata is only written once the media is saved
+    if hasMedia and 'json' in found:
+      kind = 'video' if 'mp4' in found else 'slideshow'
+      path = os.path.join(self.outputDir, 'Collections', collectionName, stem)
+      return COMPLETE, kind, f"{path}.mp4" if kind == 'video' else path
+    if found or item.id in self.storeParts:
+      return PARTIAL, None, None
+    return NEW, None, None
+
+  def orphans(self):
+    # Anything on disk no listed item maps to, e.g. removed from a collection or renamed
+    paths = []
+    for collectionName, entries in self.tree.items():
+      claimed = self.claimed.get(collectionName, set())
+      for stem, kinds in entries.items():
+        if stem in claimed: continue
+        collectionPath = os.path.join(self.outputDir, 'Collections', collectionName)
+        paths.extend(os.path.join(collectionPath, stem + suffix(kind)) for kind in sorted(kinds))
+    return paths
+
+def suffix(kind):
+  return { 'mp4': '.mp4', 'json': '.json', 'dir': '' }[kind]
+
+def buildPlan(collectionData, outputDir, manifest):
+  planner = DownloadPlanner(outputDir, manifest)
+  plan = { NEW: [], PARTIAL: [], COMPLETE: [], ORPHANED: [] }
+  for collection in collectionData['collections']:
+    seen = set()
+    for item in collection.get('itemList', []):
+      if item.id in seen: continue
+      seen.add(item.id)
+      state, _kind, _path = planner.classify(collection['name'], item)
+      plan[state].append((collection['name'], item))
+  plan[ORPHANED] = planner.orphans()
+  return plan
+
+def printPlan(plan):
+  byCollection = {}
+  for state in (NEW, PARTIAL, COMPLETE):
+    for collectionName, _item in plan[state]:
+      counts = byCollection.setdefault(collectionName, { NEW: 0, PARTIAL: 0, COMPLETE: 0 })
+      counts[state] += 1
+
+  print(f"\n{'collection':<40} {'new':>6} {'partial':>8} {'complete':>9}")
+  for collectionName, counts in sorted(byCollection.items()):
+    print(f"{collectionName[:40]:<40} {counts[NEW]:>6} {counts[PARTIAL]:>8} {counts[COMPLETE]:>9}")
+  print(f"\nTo download: {len(plan[NEW])} new, {len(plan[PARTIAL])} partial - already complete: {len(plan[COMPLETE])}")
+  if plan[ORPHANED]:
+    print(f"Orphaned on disk (not in any listed collection): {len(plan[ORPHANED])}")
+    for path in plan[ORPHANED][:20]: print(f"  {path}")
+    if len(plan[ORPHANED]) > 20: print(f"  ... and {len(plan[ORPHANED]) - 20} more")
+
+if __name__ == "__main__":
+  import sys
+  from tiktok import getOutputDir, CONFIG_FILE
+  from tiktok_collections import loadConfig, loadSavedListing
+
+  # Offline plan from the last saved listing; python main.py --dry-run refreshes the listing first
+  config = loadConfig(sys.argv[1] if len(sys.argv) > 1 else CONFIG_FILE)
+  collectionData = loadSavedListing(config)
+  outputDir = getOutputDir(config)
+  manifest = openExistingManifest(outputDir)
+  try:
+    printPlan(buildPlan(collectionData, outputDir, manifest))
+  finally:
+    if manifest: manifest.close()
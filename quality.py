@@ -0,0 +1,60 @@
+from tiktok import getOption
+
+# CodecType values TikTok uses for HEVC streams
+H265_CODECS = ('h265', 'h265_hvc1', 'bytevc1', 'hevc')
+
+def listVariants(videoInfo):
+  # One entry per bitrateInfo stream that has a URL
+  variants = []
+  for stream in videoInfo.get('bitrateInfo') or []:
+    playAddr = stream.get('PlayAddr') or {}
+    urls = playAddr.get('UrlList') or []
+    if not urls: continue
+    width, height = playAddr.get('Width') or 0, playAddr.get('Height') or 0
+    variants.append({
+      "gear": stream.get('GearName'),
+      "codec": 'h265' if str(stream.get('CodecType', '')).lower() in H265_CODECS else 'h264',
+      "bitrate": stream.get('Bitrate') or 0,
+      "width": width,
+      "height": height,
+      # Shorter side, so 720 means 720p for portrait and landscape alike
+      "resolution": min(width, height) or max(width, height),
+      "dataSize": playAddr.get('DataSize'),
+      "url": urls[0]
+    })
+  return variants
+
+def qualityPolicy(config):
+  policy = {
+    "quality": getOption(config, 'quality'),
+    "maxResolution": getOption(config, 'maxResolution'),
+    "maxBitrate": getOption(config, 'maxBitrate'),
+    "preferH265": getOption(config, 'preferH265')
+  }
+  if policy['quality'] == 'default' and not (policy['maxResolution'] or policy['maxBitrate'] or policy['preferH265']):
+    return None  # Whatever downloadAddr serves
+  return policy
+
+def chooseVariant(variants, policy):
+  if not variants: return None
+  candidates = [
+    variant for variant in variants
+    if (not policy['maxResolution'] or variant['resolution'] <= policy['maxResolution'])
+    and (not policy['maxBitrate'] or variant['bitrate'] <= policy['maxBitrate'])
+  ]
+  if not candidates:
+    # Nothing fits under the caps, so take the smallest stream there is
+    return min(variants, key=lambda variant: (variant['resolution'], variant['bitrate']))
+  if policy['preferH265']:
+    candidates = [variant for variant in candidates if variant['codec'] == 'h265'] or candidates
+  if policy['quality'] == 'min':
+    return min(candidates, key=lambda variant: (variant['resolution'], variant['bitrate']))
+  return max(candidates, key=lambda variant: (variant['resolution'], variant['bitrate']))
+
+def applyQualityPolicy(info, policy):
+  # Points downloadAddr at the chosen stream; returns the variant to record in metadata
+  if policy is None or "video" not in info: return None
+  variant = chooseVariant(listVariants(info["video"]), policy)
+  if variant is None: return None
+  info["video"]["downloadAddr"] = variant['url']
+  return { key: value for key, value in variant.items() if key not in ('url', 'resolution') }
@@ -0,0 +1,103 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from tiktok import getOption
+
+THROTTLE_STATUSES = (403, 429)
+
+class TokenBucket:
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.capacity = burst
+    self.tokens = burst
+    self.updated = time.monotonic()
+    self.lock = asyncio.Lock()
+
+  def refill(self):
+    now = time.monotonic()
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  async def acquire(self):
+    # Callers queue on the lock, so tokens are handed out in order
+    async with self.lock:
+      self.refill()
+      while self.tokens < 1:
+        await asyncio.sleep((1 - self.tokens) / self.rate)
+        self.refill()
+      self.tokens -= 1
+
+class AdaptiveThrottle(TokenBucket):
+  # Additive increase on sustained success, multiplicative decrease when throttled
+  def __init__(self, rate, burst, minRate, maxRate, increaseAfter=20, increaseStep=0.25, decrease=0.5):
+    super().__init__(rate, burst)
+    self.minRate = minRate
+    self.maxRate = maxRate
+    self.increaseAfter = increaseAfter
+    self.increaseStep = increaseStep
+    self.decrease = decrease
+    self.successStreak = 0
+    self.throttleStreak = 0
+    self.pausedUntil = 0
+
+  async def wait(self):
+    delay = self.pausedUntil - time.monotonic()
+    if delay > 0: await asyncio.sleep(delay)
+
+  async def acquire(self):
+    await self.wait()
+    await super().acquire()
+
+  def onSuccess(self):
+    self.throttleStreak = 0
+    self.successStreak += 1
+    if self.successStreak >= self.increaseAfter and self.rate < self.maxRate:
+      self.refill()
+      self.rate = min(self.maxRate, self.rate + self.increaseStep)
+      self.successStreak = 0
+
+  def onThrottle(self, retryAfter=None):
+    self.refill()
+    self.rate = max(self.minRate, self.rate * self.decrease)
+    self.tokens = min(self.tokens, 0)
+    self.successStreak = 0
+    self.throttleStreak += 1
+    pause = retryAfter if retryAfter is not None else jitteredDelay(self.throttleStreak)
+    self.pausedUntil = max(self.pausedUntil, time.monotonic() + pause)
+    print(f"\nThrottled - pausing {pause:.1f}s, rate now {self.rate:.2f} req/s")
+
+  def report(self, error):
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status in THROTTLE_STATUSES:
+      self.onThrottle(parseRetryAfter(response.headers.get('Retry-After')))
+
+def parseRetryAfter(value):
+  # Retry-After is either delta seconds or an HTTP date
+  if not value: return None
+  try:
+    return max(0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+  except (TypeError, ValueError):
+    return None
+
+def jitteredDelay(attempt, base=1, cap=60):
+  delay = min(cap, base * 2 ** attempt)
+  return delay / 2 + random.uniform(0, delay / 2)
+
+async def backoff(attempt, limiter=None):
+  await asyncio.sleep(jitteredDelay(attempt))
+  if limiter: await limiter.wait()
+
+def createRateLimiter(config):
+  return AdaptiveThrottle(
+    getOption(config, 'requestsPerSecond'),
+    getOption(config, 'burst'),
+    getOption(config, 'minRequestsPerSecond'),
+    getOption(config, 'maxRequestsPerSecond')
+  )
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+from urllib.parse import urljoin
+from tiktok import getOption
+from metrics import metrics, writeAtomic
+
+SOUNDS_DIR = "Sounds"
+INDEX_FILE = "sounds.json"
+
+def soundFilename(musicId):
+  return f"{musicId}.mp3"
+
+def soundReference(music):
+  # Path from the output directory, stored in each item's metadata
+  return f"{SOUNDS_DIR}/{soundFilename(music.id)}" if music.id and music.playUrl else None
+
+class SoundStage:
+  # Downloads each music id once into Sounds/, on its own queue and workers
+  # so sound fetches never hold a video download slot
+  def __init__(self, client, config, outputDir, streamToFile):
+    self.client = client
+    self.baseUrl = getOption(config, 'baseUrl')
+    self.root = os.path.join(outputDir, SOUNDS_DIR)
+    self.indexPath = os.path.join(self.root, INDEX_FILE)
+    self.streamToFile = streamToFile
+    os.makedirs(self.root, exist_ok=True)
+    self.index = self.loadIndex()
+    self.seen = set()
+    self.saved = 0
+    self.failed = 0
+    self.queue = asyncio.Queue()
+    self.workers = [asyncio.create_task(self.worker()) for _ in range(getOption(config, 'soundConcurrency'))]
+
+  def loadIndex(self):
+    try:
+      with open(self.indexPath, "r", encoding="utf-8") as f:
+        return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return {}
+
+  def path(self, musicId):
+    return os.path.join(self.root, soundFilename(musicId))
+
+  def add(self, music):
+    # Items across every collection share a sound, so each id is queued at most once per run
+    if not soundReference(music) or music.id in self.seen: return
+    self.seen.add(music.id)
+    if music.id in self.index and os.path.exists(self.path(music.id)):
+      metrics.inc('sounds_total', result='skipped')
+      return
+    self.queue.put_nowait(music)
+
+  async def worker(self):
+    while True:
+      music = await self.queue.get()
+      if music is None: return
+      await self.saveSound(music)
+
+  async def saveSound(self, music):
+    try:
+      with metrics.timed('saveSound'):
+        await self.streamToFile(self.client, urljoin(self.baseUrl, music.playUrl), self.path(music.id), {}, stage='saveSound')
+    except Exception as e:
+      # Play URLs are signed and expire; the next listing brings a fresh one
+      print(f"\nError saving sound {music.id} ({music.title}): {e}")
+      metrics.inc('sounds_total', result='failed')
+      self.failed += 1
+      return
+    self.index[music.id] = {
+      "title": music.title,
+      "authorName": music.authorName,
+      "duration": music.duration,
+      "original": music.original,
+      "size": os.path.getsize(self.path(music.id))
+    }
+    metrics.inc('sounds_total', result='downloaded')
+    self.saved += 1
+
+  async def close(self):
+    for _ in self.workers: self.queue.put_nowait(None)
+    try:
+      await asyncio.gather(*self.workers)
+    finally:
+      writeAtomic(self.indexPath, json.dumps(self.index, indent=2, ensure_ascii=False))
+
+  def summary(self):
+    return f"Sounds: saved {self.saved}, failed {self.failed}, {len(self.index)} in {self.root}"
@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+
+def hashFile(path, chunkSize=1024 * 1024):
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    while chunk := f.read(chunkSize):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+def linkFile(source, target):
+  # Hardlink, then symlink, then copy for filesystems without link support
+  if os.path.exists(target): return
+  try:
+    os.link(source, target)
+  except OSError:
+    try:
+      os.symlink(os.path.abspath(source), target)
+    except OSError:
+      shutil.copy2(source, target)
+
+class ContentStore:
+  def __init__(self, outputDir):
+    self.root = os.path.join(outputDir, ".store")
+    self.locks = {}
+    for folder in ("videos", "images", "slideshows"):
+      os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+
+  def lock(self, key):
+    if key not in self.locks:
+      self.locks[key] = asyncio.Lock()
+    return self.locks[key]
+
+  def videoPath(self, videoId):
+    return os.path.join(self.root, "videos", f"{videoId}.mp4")
+
+  def imagePath(self, digest):
+    return os.path.join(self.root, "images", f"{digest}.jpg")
+
+  def slideshowPath(self, videoId):
+    return os.path.join(self.root, "slideshows", f"{videoId}.json")
+
+  def loadSlideshow(self, videoId):
+    try:
+      with open(self.slideshowPath(videoId), "r") as f:
+        digests = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+    if all(os.path.exists(self.imagePath(digest)) for digest in digests):
+      return digests
+    return None
+
+  def saveSlideshow(self, videoId, digests):
+    with open(self.slideshowPath(videoId), "w") as f:
+      json.dump(digests, f)
+
+  def absorbImage(self, path):
+    # Move a downloaded image into the store by content hash and link it back
+    digest = hashFile(path)
+    storePath = self.imagePath(digest)
+    if not os.path.exists(storePath):
+      os.replace(path, storePath)
+    elif os.path.samefile(path, storePath):
+      return digest
+    else:
+      os.remove(path)
+    linkFile(storePath, path)
+    return digest
+
+  def linkVideo(self, videoId, videoPath):
+    storePath = self.videoPath(videoId)
+    if not os.path.exists(storePath): return False
+    linkFile(storePath, videoPath)
+    return True
+
+  def linkSlideshow(self, videoId, slideShowPath):
+    digests = self.loadSlideshow(videoId)
+    if digests is None: return False
+    os.makedirs(slideShowPath, exist_ok=True)
+    for i, digest in enumerate(digests):
+      linkFile(self.imagePath(digest), os.path.join(slideShowPath, f"image-{i+1}.jpg"))
+    return True
@@ -1,9 +1,51 @@
-from playwright.sync_api import sync_playwright
 import json
 import time
 
-def getOrCreateConfig():
-  configFile = 'tiktok_config.json'
+CONFIG_FILE = 'tiktok_config.json'
+
+DEFAULT_OPTIONS = {
+  "baseUrl": "https://www.tiktok.com",
+  "concurrency": 4,
+  "perHostLimit": 2,
+  "maxConnections": 20,
+  "maxKeepalive": 10,
+  "keepaliveExpiry": 30,
+  "imageConcurrency": 4,
+  "hedgeDelay": None,
+  "fullSync": False,
+  "listConcurrency": 4,
+  "requestsPerSecond": 2,
+  "minRequestsPerSecond": 0.2,
+  "maxRequestsPerSecond": 8,
+  "burst": 4,
+  "browserSessions": 1,
+  "sessionMaxFailures": 3,
+  "metricsTextfile": None,
+  "liveSummary": False,
+  "outputDir": None,
+  "pipeline": False,
+  "saveSounds": False,
+  "soundConcurrency": 2,
+  "quality": "default",
+  "maxResolution": None,
+  "maxBitrate": None,
+  "preferH265": False,
+  "metadataIndex": False,
+  "metadataFiles": True
+}
+
+def getOption(config, name):
+  options = (config or {}).get('options', {})
+  return options.get(name, DEFAULT_OPTIONS.get(name))
+
+def getOutputDir(config):
+  return getOption(config, 'outputDir') or f"{config['app_context']['user']['uniqueId']}-tiktok-collection"
+
+def loadConfig(configFile=CONFIG_FILE):
+  with open(configFile, 'r') as f:
+    return json.load(f)
+
+def getOrCreateConfig(configFile=CONFIG_FILE):
   config = { 'cookies': [], 'app_context': {} }
   
   try:
@@ -14,8 +56,8 @@ def getOrCreateConfig():
       json.dump(config, f, indent=2)
     return config
 
-def saveConfig(config):
-    with open('tiktok_config.json', 'w') as f:
+def saveConfig(config, configFile=CONFIG_FILE):
+    with open(configFile, 'w') as f:
       json.dump(config, f, indent=2)
 
 def getAuthTokens(cookies):
@@ -23,7 +65,8 @@ def getAuthTokens(cookies):
   sessionId = next((cookie['value'] for cookie in cookies if cookie['name'] == 'sessionid'), '')
   return msToken, sessionId
 
-def captureTiktokData(config):
+def captureTiktokData(config, configFile=CONFIG_FILE):
+  from playwright.sync_api import sync_playwright
   print("No cookies found in config, login to TikTok to continue")
   with sync_playwright() as p:
     browser = p.chromium.launch(headless=False)
@@ -62,19 +105,20 @@ def captureTiktokData(config):
     page.wait_for_selector('p[role="tab"][aria-selected="true"]:has-text("Favorites")')
     page.click("button#collections")
 
-    saveConfig(config)
+    saveConfig(config, configFile)
     time.sleep(10)
     browser.close()
 
-def getTiktokData():
-  config = getOrCreateConfig()
+def getTiktokData(configFile=CONFIG_FILE):
+  config = getOrCreateConfig(configFile)
 
   # Add token validation
   if not config.get('cookies'):
     msToken, sessionId = getAuthTokens(config['cookies'])
     if msToken and sessionId: print("Session cookies found, skipping login")
-    else: captureTiktokData(config)
+    else: captureTiktokData(config, configFile)
   return config
 
 if __name__ == "__main__":
-  getTiktokData()
\ No newline at end of file
+  import sys
+  getTiktokData(sys.argv[1] if len(sys.argv) > 1 else CONFIG_FILE)
\ No newline at end of file
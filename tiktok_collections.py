@@ -1,15 +1,25 @@
 import json
 import os
-import requests
+import asyncio
+import httpx
 import time
 from types import SimpleNamespace
-from tiktok import getAuthTokens
+from tiktok import getAuthTokens, getOption, loadConfig
+from ratelimit import createRateLimiter, backoff
+from metrics import metrics
+from journal import ListingJournal
+from models import CollectionItem, loadItems, loadCollections, toJson
 
-def buildUrl(appContext, cursor=0, collectionId=None, type="list"):
+MAX_EMPTY_RETRIES = 1
+UNCATEGORIZED = "Uncategorized"
+
+WATERMARK_SIZE = 5
+
+def buildUrl(appContext, cursor=0, collectionId=None, type="list", baseUrl="https://www.tiktok.com"):
   baseUrls = {
-    "list": "https://www.tiktok.com/api/user/collection_list/",
-    "items": "https://www.tiktok.com/api/collection/item_list/",
-    "favorites": "https://www.tiktok.com/api/user/collect/item_list/",
+    "list": f"{baseUrl}/api/user/collection_list/",
+    "items": f"{baseUrl}/api/collection/item_list/",
+    "favorites": f"{baseUrl}/api/user/collect/item_list/",
   }
 
   queryParams = {
@@ -26,31 +36,25 @@ def buildUrl(appContext, cursor=0, collectionId=None, type="list"):
 
   return baseUrls[type] + "?" + "&".join(f"{k}={v}" for k, v in queryParams.items())
 
-def loadConfig():
-  with open('tiktok_config.json', 'r') as f:
-    return json.load(f)
-  return config
-
-def makeRequest(url, headers):
-  session = requests.Session()
+async def makeRequest(client, url, headers, limiter=None):
   retries = 3
-  for attempt in range(retries):
-    try:
-      response = session.get(
-        url,
-        headers=headers,
-        verify=True,
-        timeout=10
-      )
-      return response.json()
-    except requests.exceptions.SSLError:
-      if attempt == retries - 1:
-        raise
-      time.sleep(2 * (attempt + 1))  # Exponential backoff
-    except requests.exceptions.RequestException:
-      if attempt == retries - 1:
-        raise
-      time.sleep(2 * (attempt + 1))
+  with metrics.timed('makeRequest'):
+    for attempt in range(retries):
+      try:
+        if limiter: await limiter.acquire()
+        metrics.inc('requests_total', stage='makeRequest')
+        response = await client.get(url, headers=headers)
+        metrics.inc('bytes_total', len(response.content), stage='makeRequest')
+        response.raise_for_status()
+        data = response.json()
+        if limiter: limiter.onSuccess()
+        return data
+      except (httpx.HTTPError, ValueError) as e:
+        if limiter: limiter.report(e)
+        if attempt == retries - 1:
+          raise
+        metrics.retry('makeRequest', e)
+        await backoff(attempt, limiter)  # Jittered exponential backoff
 
 
 def buildHeaders(appContext, msToken, sessionId):
@@ -63,10 +67,38 @@ def buildHeaders(appContext, msToken, sessionId):
 
 def saveToJson(data, fileName):
   with open(fileName, 'w') as f:
-    json.dump(data, f, indent=2)
+    json.dump(data, f, indent=2, default=toJson)
     f.flush()
   print(f"\nData saved to {fileName}")
 
+def saveConsolidated(data, fileName, journal):
+  # Streams each collection's new items back out of the journal, followed by its known items
+  tmpName = f"{fileName}.tmp"
+  with open(tmpName, 'w') as f:
+    f.write("{")
+    for key, value in data.items():
+      if key != 'collections': f.write(f"{json.dumps(key)}: {json.dumps(value)}, ")
+    f.write('"collections": [')
+
+    for index, collection in enumerate(data['collections']):
+      fields = { key: value for key, value in collection.items() if key != 'itemList' }
+      f.write(",\n" if index else "\n")
+      f.write(json.dumps(fields)[:-1] + (", " if fields else "") + '"itemList": [')
+
+      count = 0
+      for item in journal.iterItems(collection['collectionId']):
+        f.write((",\n" if count else "\n") + json.dumps(item))
+        count += 1
+      for item in collection.get('itemList', [])[count:]:
+        f.write((",\n" if count else "\n") + json.dumps(item.toDict()))
+        count += 1
+      f.write("\n]}")
+
+    f.write("\n]}\n")
+    f.flush()
+  os.replace(tmpName, fileName)
+  print(f"\nData saved to {fileName}")
+
 def recentSave(filename):
   return os.path.exists(filename) and time.time() - os.path.getmtime(filename) < 12 * 3600
 
@@ -76,47 +108,66 @@ def recentlyCollected(dataFilePath, collections):
   return (recent and itemsCollected)
 
 def map_collection_item(item):
+  return CollectionItem.fromDict(item)
+
+def loadSavedData(dataFilePath):
+  try:
+    with open(dataFilePath, 'r') as f:
+      return json.load(f)
+  except (FileNotFoundError, json.JSONDecodeError):
+    return {}
+
+def buildWatermark(itemList, total):
   return {
-    'author': {
-      'id': item['author']['id'],
-      'nickname': item['author']['nickname'],
-      'secUid': item['author']['secUid'],
-      'signature': item['author']['signature'],
-      'uniqueId': item['author']['uniqueId'],
-      'verified': item['author']['verified']
-    },
-    'contents': item.get('contents', []),
-    'createTime': item['createTime'],
-    'desc': item['desc'],
-    'id': item['id'],
-    'music': {
-      'authorName': item['music'].get('authorName', ''),
-      'duration': item['music'].get('duration', 0),
-      'id': item['music'].get('id', ''),
-      'original': item['music'].get('original', False),
-      'playUrl': item['music'].get('playUrl', ''),
-      'title': item['music'].get('title', '')
-    },
-    'stats': {
-      'collectCount': item['stats'].get('collectCount', 0),
-      'commentCount': item['stats'].get('commentCount', 0),
-      'diggCount': item['stats'].get('diggCount', 0),
-      'playCount': item['stats'].get('playCount', 0),
-      'shareCount': item['stats'].get('shareCount', 0)
-    },
-    'video': {
-      'duration': item['video'].get('duration', 0),
-      'format': item['video'].get('format', 'mp4'),
-      'width': item['video'].get('width', 0),
-      'height': item['video'].get('height', 0),
-      'id': item['video']['id'],
-      'ratio': item['video'].get('ratio', '')
-    }
-}
-
-def getCollectionData(config=None):
+    'ids': [item.id for item in itemList[:WATERMARK_SIZE]],
+    'total': total,
+    'syncedAt': int(time.time())
+  }
+
+async def fetchItemPages(client, config, limiter, items, knownIds=(), stopIds=(), collectionId=None, type="items", expectItems=False, cursor=0, journal=None, onItems=None):
+  # Pages newest first, stopping at the first watermark id. Returns whether it was reached
+  msToken, sessionId = getAuthTokens(config['cookies'])
+  headers = buildHeaders(config['app_context'], msToken, sessionId)
+  hasMore = True
+  emptyRetries = 0
+
+  while hasMore:
+    reqUrl = buildUrl(config['app_context'], cursor, collectionId, type, getOption(config, 'baseUrl'))
+    data = await makeRequest(client, reqUrl, headers, limiter)
+    if not data.get('itemList'):
+      # An empty page where more items were promised is how throttling usually shows up
+      if (cursor or expectItems) and emptyRetries < MAX_EMPTY_RETRIES:
+        emptyRetries += 1
+        limiter.onThrottle()
+        continue
+      break
+    emptyRetries = 0
+
+    pageItems = []
+    reachedKnown = False
+    for item in data['itemList']:
+      if item['id'] in stopIds:
+        reachedKnown = True
+        break
+      if item['id'] not in knownIds:
+        pageItems.append(map_collection_item(item))
+    items.extend(pageItems)
+    hasMore = data.get('hasMore', False) and not reachedKnown
+    nextCursor = data.get('cursor', 0)
+    if journal: journal.append(collectionId, cursor, nextCursor, hasMore, pageItems)
+    if onItems and pageItems: onItems(pageItems)
+
+    if reachedKnown:
+      print(f"Reached last synced item. New: {len(items)}")
+      return True
+    cursor = nextCursor
+    print(f"Got {len(data['itemList'])} items. Total: {len(items)}")
+  return False
+
+async def getCollectionData(client, config=None, limiter=None):
   if not config:
     config = loadConfig()
+  limiter = limiter or createRateLimiter(config)
   msToken, sessionId = getAuthTokens(config['cookies'])
   dataFilePath = f"collection_data_{config['app_context']['user']['uniqueId']}.json"
   
@@ -126,9 +177,9 @@ def getCollectionData(config=None):
   collections = [] if hasMore else json.load(open(dataFilePath))['collections']
   
   while hasMore:
-    reqUrl = buildUrl(config['app_context'], cursor)
+    reqUrl = buildUrl(config['app_context'], cursor, baseUrl=getOption(config, 'baseUrl'))
     headers = buildHeaders(config['app_context'], msToken, sessionId)
-    data = makeRequest(reqUrl, headers)
+    data = await makeRequest(client, reqUrl, headers, limiter)
 
     if 'collectionList' in data:
       collections.extend(data['collectionList'])
@@ -138,7 +189,13 @@ def getCollectionData(config=None):
     else:
       hasMore = False
 
-    time.sleep(1)
+  # Carry known items & watermarks over for incremental syncs
+  saved = { collection['collectionId']: collection for collection in loadSavedData(dataFilePath).get('collections', []) }
+  for collection in collections:
+    previous = saved.get(collection['collectionId'], {})
+    if 'watermark' in previous:
+      collection['itemList'] = loadItems(previous.get('itemList', []))
+      collection['watermark'] = previous['watermark']
 
   outputData = {
     'total': len(collections),
@@ -149,15 +206,54 @@ def getCollectionData(config=None):
   saveToJson(outputData, dataFilePath)
   return collections
 
-def getCollectionItems(config=None, collectionData=None):
+async def syncCollection(client, config, limiter, collection, full=False, journal=None, onItems=None):
+  collectionId = collection['collectionId']
+  resumed = journal.resume(collectionId) if journal else None
+  full = full or bool(resumed and resumed['full'])
+  known = [] if full else collection.get('itemList', [])
+  watermark = {} if full else collection.get('watermark', {})
+  knownIds = { item.id for item in known }
+  stopIds = set(watermark.get('ids', [])) & knownIds
+  newItems = loadItems(resumed['items']) if resumed else []
+  cursor = resumed['cursor'] if resumed else 0
+  pageHandler = (lambda page: onItems(collection, page)) if onItems else None
+  if pageHandler and (newItems or known): pageHandler(newItems + known)
+
+  try:
+    mode = "incremental" if stopIds else "full"
+    if resumed and not resumed['hasMore']:
+      print(f"\nCollection already fetched before restart: {collection['name']}")
+    else:
+      resumeLog = f", resuming at cursor {cursor}" if resumed else ""
+      print(f"\nFetching collection: {collection['name']} - Total: {collection['total']} ({mode}{resumeLog})")
+      await fetchItemPages(client, config, limiter, newItems, knownIds, stopIds, collectionId, expectItems=collection['total'] > 0, cursor=cursor, journal=journal, onItems=pageHandler)
+
+    # New items should account for every change in the reported total, otherwise items were removed
+    if stopIds and collection['total'] - watermark.get('total', 0) != len(newItems):
+      print(f"Totals no longer match for {collection['name']} - running full resync")
+      if journal: journal.reset(collectionId)
+      known, newItems = [], []
+      await fetchItemPages(client, config, limiter, newItems, collectionId=collectionId, expectItems=True, journal=journal, onItems=pageHandler)
+    collection['watermark'] = buildWatermark(newItems + known, collection['total'])
+  except Exception as e:
+    # The previous watermark is kept so the next sync still reaches the unfetched items
+    print(f"\nError fetching collection {collection['name']}: {str(e)}")
+    print("Saving progress and continuing to next collection...")
+
+  collection['itemList'] = newItems + known
+  return collection['itemList']
+
+async def getCollectionItems(client, config=None, collectionData=None, full=None, limiter=None, onItems=None):
   if not config:
     config = loadConfig()
-  msToken, sessionId = getAuthTokens(config['cookies'])
+  limiter = limiter or createRateLimiter(config)
+  if full is None:
+    full = getOption(config, 'fullSync')
   dataFilePath = f"collection_data_{config['app_context']['user']['uniqueId']}.json"
 
   if not collectionData:
     with open(dataFilePath, 'r') as f:
-      collectionData = json.load(f)
+      collectionData = loadCollections(json.load(f))
   
   # Bugged
   # if recentlyCollected(dataFilePath, collectionData['collections']):
@@ -165,103 +261,114 @@ def getCollectionItems(config=None, collectionData=None):
   #   return collectionData
 
   else:
-    totalItems = 0
-    for collection in collectionData['collections']:
-      collectionItems = []
-      cursor = 0
-      hasMore = True
+    # Every fetched page is journaled, so a crashed run resumes from the last saved cursors
+    journal = ListingJournal(f"collection_data_{config['app_context']['user']['uniqueId']}.journal.jsonl")
 
-      try:
-        print(f"\nFetching collection: {collection['name']} - Total: {collection['total']}")
-        while hasMore:
-          reqUrl = buildUrl(config['app_context'], cursor, collection['collectionId'])
-          headers = buildHeaders(config['app_context'], msToken, sessionId)
-          data = makeRequest(reqUrl, headers)
-          
-          
-          if 'itemList' in data:
-            collectionItems.extend([map_collection_item(item) for item in data['itemList']])
-            hasMore = data.get('hasMore', False)
-            cursor = data.get('cursor', 0)
-            print(f"Got {len(data['itemList'])} items. Total: {len(collectionItems)}")
-          else:
-            hasMore = False
-          
-          time.sleep(1)
-      except Exception as e:
-        print(f"\nError fetching collection {collection['name']}: {str(e)}")
-        print("Saving progress and continuing to next collection...")
-
-      # Directly add items to the collection in collectionDict
-      for idx, collectionStore in enumerate(collectionData['collections']):
-        if collectionStore['collectionId'] == collection['collectionId']:
-          collectionData['collections'][idx]['itemList'] = collectionItems
-          items_in_collection = len(collectionItems)
-          print(f"Collection '{collectionStore['name']}': {items_in_collection} items")
-          totalItems += items_in_collection
-          break
-      
-      print(f"\nTotal items across all collections: {totalItems}")
-
-    saveToJson(collectionData, dataFilePath)
+    # Collections page concurrently, sharing the request budget of one limiter
+    semaphore = asyncio.Semaphore(getOption(config, 'listConcurrency'))
+    async def syncWithLimit(collection):
+      async with semaphore:
+        collectionItems = await syncCollection(client, config, limiter, collection, full, journal, onItems)
+      print(f"Collection '{collection['name']}': {len(collectionItems)} items")
+      return len(collectionItems)
+
+    totals = await asyncio.gather(*(syncWithLimit(collection) for collection in collectionData['collections']))
+    print(f"\nTotal items across all collections: {sum(totals)}")
+
+    saveConsolidated(collectionData, dataFilePath, journal)
+    journal.remove()
     return collectionData
 
-def getFavorites(config=None):
+async def getFavorites(client, config=None, full=None, limiter=None, onItems=None):
   if not config:
     config = loadConfig()
-  msToken, sessionId = getAuthTokens(config['cookies'])
+  limiter = limiter or createRateLimiter(config)
+  if full is None:
+    full = getOption(config, 'fullSync')
   dataFilePath = f"favorites_data_{config['app_context']['user']['uniqueId']}.json"
 
-  cursor = 0
-  hasMore = not recentSave(dataFilePath)
-  favorites = [] if hasMore else json.load(open(dataFilePath))['favorites']
+  saved = {} if full else loadSavedData(dataFilePath)
+  known = loadItems(saved.get('favorites', []))
+  if onItems and known: onItems(known)
+  # An interrupted pass is resumed even when the file was written recently
+  if recentSave(dataFilePath) and saved.get('complete', True) and not full:
+    return known
+
+  watermark = saved.get('watermark', {})
+  knownIds = { item.id for item in known }
+  stopIds = set(watermark.get('ids', [])) & knownIds
+  newFavorites = []
+  complete = False
 
   try:
-    while hasMore:
-      reqUrl = buildUrl(config['app_context'], cursor, None, "favorites")
-      headers = buildHeaders(config['app_context'], msToken, sessionId)
-      data = makeRequest(reqUrl, headers)
-
-      if 'itemList' in data:
-        favorites.extend([map_collection_item(item) for item in data['itemList']])
-        hasMore = data.get('hasMore', False)
-        cursor = data.get('cursor', 0)
-        print(f"Got {len(data['itemList'])} items. Total: {len(favorites)}")
-      time.sleep(1)
+    await fetchItemPages(client, config, limiter, newFavorites, knownIds, stopIds, None, "favorites", onItems=onItems)
+    complete = True
   except Exception as e:
     print(f"\nError fetching favorites: {str(e)}")
     print("Saving progress and continuing to next collection...")
 
+  favorites = newFavorites + known
   outputData = {
     'total': len(favorites),
     'user': config['app_context']['user'],
+    # The previous watermark is kept so the next sync still reaches the unfetched items
+    'watermark': buildWatermark(favorites, len(favorites)) if complete else watermark,
+    'complete': complete,
     'favorites': favorites
   }
 
   saveToJson(outputData, dataFilePath)
   return favorites
 
-def getUncategorizedFavorites(collectionItems, config=None):
+class UncategorizedFilter:
+  # Favorites stay pending until a collection claims their id; whatever is left once
+  # every collection is listed is uncategorized
+  def __init__(self):
+    self.collectedIds = set()
+    self.pending = {}
+
+  def addCollected(self, items):
+    for item in items:
+      self.collectedIds.add(item.id)
+      self.pending.pop(item.id, None)
+
+  def addFavorites(self, items):
+    for item in items:
+      if item.id not in self.collectedIds:
+        self.pending.setdefault(item.id, item)
+
+  def uncategorized(self):
+    return list(self.pending.values())
+
+async def getUncategorizedFavorites(client, collectionItems, config=None, limiter=None):
   if not config:
     config = loadConfig()
   
   # Get all video IDs from collections
-  collectedIds = set()
+  uncategorized = UncategorizedFilter()
   for collection in collectionItems["collections"]:
-    collectedIds.update(item['id'] for item in collection.get('itemList', []))
-  print(f"Total unique videos found in collections: {len(collectedIds)}")
+    uncategorized.addCollected(collection.get('itemList', []))
+  print(f"Total unique videos found in collections: {len(uncategorized.collectedIds)}")
   
   # Get favorites and filter out already collected ones
-  favorites = getFavorites(config)
-  uncategorized = [
-    item 
-    for item in favorites 
-    if item['id'] not in collectedIds
-  ]
+  uncategorized.addFavorites(await getFavorites(client, config, limiter=limiter))
   
   return {
-    "collections": [{ "name": "Uncategorized", "itemList": uncategorized }]
+    "collections": [{ "name": UNCATEGORIZED, "itemList": uncategorized.uncategorized() }]
   }
 
+def loadSavedListing(config):
+  # Collections & uncategorized favorites as of the last listing, without any request
+  user = config['app_context']['user']['uniqueId']
+  collectionData = loadCollections(loadSavedData(f"collection_data_{user}.json") or { "collections": [] })
+  favorites = loadItems(loadSavedData(f"favorites_data_{user}.json").get('favorites', []))
+
+  uncategorized = UncategorizedFilter()
+  for collection in collectionData['collections']:
+    uncategorized.addCollected(collection.get('itemList', []))
+  uncategorized.addFavorites(favorites)
+  collectionData['collections'].append({ "name": UNCATEGORIZED, "itemList": uncategorized.uncategorized() })
+  return collectionData
+
 if __name__ == "__main__":
   pass
\ No newline at end of file
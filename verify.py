@@ -0,0 +1,266 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from planner import scanOutputDir
+
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+# mp4 durations are rounded differently by TikTok's API and the muxer
+DURATION_TOLERANCE = 1.5
+
+def mapFile(f):
+  size = os.fstat(f.fileno()).st_size
+  return (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None), size
+
+def iterBoxes(data, start, end):
+  # (type, payloadStart, boxEnd) for each box, stopping at the first one that overruns end
+  offset = start
+  while offset + 8 <= end:
+    size, kind = struct.unpack_from(">I4s", data, offset)
+    headerSize = 8
+    if size == 1:
+      if offset + 16 > end: raise ValueError(f"truncated {kind.decode('latin-1')} header")
+      size = struct.unpack_from(">Q", data, offset + 8)[0]
+      headerSize = 16
+    elif size == 0:
+      size = end - offset
+    if size < headerSize: raise ValueError(f"invalid {kind.decode('latin-1')} box size {size}")
+    if offset + size > end:
+      raise ValueError(f"{kind.decode('latin-1')} box runs {offset + size - end} bytes past the end (truncated)")
+    yield kind, offset + headerSize, offset + size
+    offset += size
+  if offset != end:
+    raise ValueError(f"{end - offset} trailing bytes after the last box")
+
+def readMvhdDuration(data, start):
+  version = data[start]
+  if version == 1:
+    timescale, duration = struct.unpack_from(">IQ", data, start + 20)
+  else:
+    timescale, duration = struct.unpack_from(">II", data, start + 12)
+  return duration / timescale if timescale else None
+
+def checkMp4(path, expectedDuration=None):
+  # Walks box headers only, so a multi-GB file costs a handful of page reads
+  with open(path, "rb") as f:
+    data, size = mapFile(f)
+    if data is None: return ["empty file"]
+    try:
+      boxes = { kind: (start, end) for kind, start, end in iterBoxes(data, 0, size) }
+      problems = [f"missing {kind.decode()} box" for kind in (b"ftyp", b"moov", b"mdat") if kind not in boxes]
+      if b"moov" in boxes:
+        duration = None
+        for kind, start, end in iterBoxes(data, *boxes[b"moov"]):
+          if kind == b"mvhd": duration = readMvhdDuration(data, start)
+        if duration is None:
+          problems.append("no duration in moov/mvhd")
+        elif expectedDuration and abs(duration - expectedDuration) > max(DURATION_TOLERANCE, expectedDuration * 0.05):
+          problems.append(f"duration {duration:.1f}s, expected {expectedDuration}s")
+      return problems
+    except (ValueError, struct.error) as e:
+      return [str(e)]
+    finally:
+      data.close()
+
+def checkImage(path):
+  with open(path, "rb") as f:
+    data, size = mapFile(f)
+    if data is None: return ["empty file"]
+    try:
+      tail = data[-16:].rstrip(b"\0")
+      if data[:2] == b"\xff\xd8":
+        if not tail.endswith(b"\xff\xd9"): return ["jpeg missing end marker (truncated)"]
+      elif data[:8] == b"\x89PNG\r\n\x1a\n":
+        if b"IEND" not in data[-12:]: return ["png missing IEND chunk (truncated)"]
+      elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        if struct.unpack_from("<I", data, 4)[0] + 8 > size: return ["webp shorter than its header (truncated)"]
+      elif data[:4] == b"GIF8":
+        if not tail.endswith(b"\x3b"): return ["gif missing trailer (truncated)"]
+      else:
+        return ["not a recognized image format"]
+    finally:
+      data.close()
+
+  # Full decode when Pillow is available
+  if Image is not None:
+    try:
+      with Image.open(path) as image:
+        image.load()
+    except Exception as e:
+      return [f"decode failed: {e}"]
+  return []
+
+def hashMapped(path):
+  with open(path, "rb") as f:
+    data, _size = mapFile(f)
+    if data is None: return hashlib.sha256().hexdigest()
+    try:
+      return hashlib.sha256(data).hexdigest()
+    finally:
+      data.close()
+
+def readMetadata(metaPath):
+  try:
+    with open(metaPath, "r", encoding="utf-8") as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+def taskMetadata(task):
+  # Items saved without a JSON file carry their metadata from the index
+  return json.loads(task['metadata']) if task.get('metadata') else readMetadata(task['metaPath'])
+
+def verifyEntry(task):
+  # Runs in a worker process: every read for one item happens here
+  metadata = taskMetadata(task)
+  result = { **task, "id": metadata.get('id') if metadata else None, "problems": [] }
+  problems = result['problems']
+  if metadata is None:
+    problems.append("metadata unreadable")
+
+  if task['kind'] == 'video':
+    expected = ((metadata or {}).get('video') or {}).get('duration')
+    problems.extend(checkMp4(task['path'], expected))
+    if task['withChecksum'] and task['checksum'] and not problems:
+      if hashMapped(task['path']) != task['checksum']: problems.append("checksum mismatch")
+  else:
+    images = sorted((entry for entry in os.scandir(task['path']) if entry.name.lower().endswith(PHOTO_EXTENSIONS)),
+                    key=lambda entry: entry.name)
+    if any(entry.name.endswith('.part') for entry in os.scandir(task['path'])):
+      problems.append("unfinished image download")
+    if not images:
+      problems.append("no images")
+    expectedImages = len(readMetadata(os.path.join(task['slideshowsDir'], f"{result['id']}.json")) or []) if result['id'] else 0
+    if len(images) < expectedImages:
+      problems.append(f"{len(images)}/{expectedImages} images")
+    badImages = []
+    for entry in images:
+      imageProblems = checkImage(entry.path)
+      if imageProblems:
+        badImages.append(entry.path)
+        problems.append(f"{entry.name}: {imageProblems[0]}")
+    result['badImages'] = badImages
+    if task['withChecksum'] and task['checksum'] and not problems:
+      digests = [hashMapped(entry.path) for entry in sorted(images, key=lambda entry: imageNumber(entry.name))]
+      if hashlib.sha256(''.join(digests).encode()).hexdigest() != task['checksum']: problems.append("checksum mismatch")
+  return result
+
+def imageNumber(name):
+  try:
+    return int(name.split('-', 1)[1].split('.', 1)[0])
+  except (IndexError, ValueError):
+    return 0
+
+def buildTasks(outputDir, manifest, store, withChecksum=False, indexed=None):
+  rows = manifest.rows()
+  indexed = indexed or {}
+  tasks = []
+  incomplete = 0
+  for collectionName, entries in scanOutputDir(outputDir).items():
+    collectionPath = os.path.join(outputDir, 'Collections', collectionName)
+    for stem, kinds in entries.items():
+      if 'mp4' in kinds:
+        kind, path = 'video', os.path.join(collectionPath, f"{stem}.mp4")
+      elif 'dir' in kinds:
+        kind, path = 'slideshow', os.path.join(collectionPath, stem)
+      else:
+        kind, path = None, None
+      metadata = indexed.get(path) if path and 'json' not in kinds else None
+      if 'json' not in kinds and metadata is None:
+        incomplete += 1  # Media without metadata is an interrupted download the planner already retries
+        continue
+      if kind is None: continue
+      tasks.append({ "collection": collectionName, "stem": stem, "kind": kind, "path": path, "metadata": metadata,
+                     "metaPath": os.path.join(collectionPath, f"{stem}.json"), "withChecksum": withChecksum })
+
+  # Manifest checksums come from the main process, slideshow image counts from the store
+  byPath = { row['path']: row for row in rows.values() }
+  for task in tasks:
+    row = byPath.get(task['path'])
+    task['checksum'] = row['checksum'] if row else None
+    task['slideshowsDir'] = os.path.dirname(store.slideshowPath('_'))
+  return tasks, incomplete
+
+def uniqueByInode(tasks):
+  # Hardlinked copies of one video across collections are checked once
+  groups = {}
+  for task in tasks:
+    if task['kind'] == 'video':
+      stat = os.stat(task['path'])
+      key = (stat.st_dev, stat.st_ino)
+    else:
+      key = task['path']
+    groups.setdefault(key, []).append(task)
+  return groups
+
+def quarantine(outputDir, path):
+  # Corrupt files are moved aside rather than deleted
+  target = os.path.join(outputDir, ".quarantine", os.path.relpath(path, outputDir))
+  os.makedirs(os.path.dirname(target), exist_ok=True)
+  if os.path.exists(target):
+    target = f"{target}.{int(time.time())}"
+  shutil.move(path, target)
+
+def queueRedownload(outputDir, manifest, store, result, failures):
+  videoId = result['id']
+  if result['kind'] == 'video':
+    quarantine(outputDir, result['path'])
+    if videoId and os.path.exists(store.videoPath(videoId)): os.remove(store.videoPath(videoId))
+  else:
+    # Store images are hardlinks of the broken ones; drop them too so the refetch isn't relinked to them
+    digests = (readMetadata(store.slideshowPath(videoId)) or []) if videoId else []
+    for imagePath in result.get('badImages', []):
+      index = imageNumber(os.path.basename(imagePath)) - 1
+      if 0 <= index < len(digests) and os.path.exists(store.imagePath(digests[index])):
+        os.remove(store.imagePath(digests[index]))
+      quarantine(outputDir, imagePath)
+    if videoId and os.path.exists(store.slideshowPath(videoId)): os.remove(store.slideshowPath(videoId))
+  if not videoId: return
+
+  manifest.record(videoId, result['collection'], result['path'], 'failed', commit=False)
+  failures[videoId] = {
+    "collection": result['collection'],
+    "class": "corrupt",
+    "error": "verify: " + "; ".join(result['problems']),
+    "metadata": taskMetadata(result)
+  }
+
+def verifyLibrary(outputDir, manifest, store, withChecksum=False, workers=None, repair=True, indexed=None):
+  started = time.time()
+  tasks, incomplete = buildTasks(outputDir, manifest, store, withChecksum, indexed)
+  groups = list(uniqueByInode(tasks).values())
+  print(f"Verifying {len(tasks)} items ({len(groups)} unique files) with {workers or os.cpu_count()} workers")
+
+  failed = []
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    for group, result in zip(groups, pool.map(verifyEntry, [group[0] for group in groups], chunksize=32)):
+      if not result['problems']: continue
+      # Every hardlinked copy shares the verdict of the checked file
+      for task in group:
+        failed.append({ **result, "collection": task['collection'], "stem": task['stem'], "path": task['path'],
+                        "metaPath": task['metaPath'], "metadata": task['metadata'] })
+
+  failures = {}
+  if repair:
+    for result in failed: queueRedownload(outputDir, manifest, store, result, failures)
+    manifest.db.commit()
+
+  report = {
+    "checkedAt": int(started),
+    "seconds": round(time.time() - started, 1),
+    "items": len(tasks),
+    "uniqueFiles": len(groups),
+    "failed": len(failed),
+    "incomplete": incomplete,
+    "failures": [{ "collection": r['collection'], "id": r['id'], "path": r['path'], "problems": r['problems'] } for r in failed]
+  }
+  return report, failures